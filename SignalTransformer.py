@@ -1,10 +1,38 @@
 """Module providing transformer function for time series data (pandas.Series with datetime index)
 """
 
+import sys
+import time
+import numpy as np
 import pandas as pd
 import datetime as dt
 import inspect
 from typing import Callable
+from numpy.lib.stride_tricks import sliding_window_view
+from calendar_resample import resample_calendar, Period
+
+# windows up to this size are faster as sorted NumPy chunks than with the pandas skiplist
+MAX_NUMPY_MEDIAN_WINDOW = 11
+MEDIAN_CHUNK_POINTS = 1 << 20  # bounds the memory of the NumPy windows
+
+
+def _rolling_median(input_series: pd.Series, window_points: int, center: bool = False) -> pd.Series:
+    """Returns the rolling median like input_series.rolling(window_points, center=center).median()
+    """
+    if window_points > MAX_NUMPY_MEDIAN_WINDOW or window_points < 1:
+        return input_series.rolling(window_points, center=center).median()
+    values = input_series.to_numpy(dtype=np.float64)
+    output_values = np.full(len(values), np.nan)
+    offset = window_points // 2 if center else window_points - 1
+    half = window_points // 2
+    for start in range(0, len(values) - window_points + 1, MEDIAN_CHUNK_POINTS):
+        windows = np.sort(sliding_window_view(values[start:start + MEDIAN_CHUNK_POINTS + window_points - 1], 
+                                              window_points), axis=1)
+        medians = windows[:, half] if window_points % 2 else (windows[:, half - 1] + windows[:, half]) / 2
+        medians[np.isnan(windows[:, -1])] = np.nan  # NaNs are sorted last, like pandas any NaN gives NaN
+        output_values[start + offset:start + offset + len(windows)] = medians
+    return pd.Series(output_values, index=input_series.index, name=input_series.name)
+
 
 class SignalTransformers():
     """
@@ -43,6 +71,77 @@ class SignalTransformers():
             output_series.name += f".mean{int(interval_hours)}h"
         return output_series
     
+    @staticmethod
+    def resample_calendar(input_series: pd.Series, period: Period = "day", tz: str = "Europe/Berlin", 
+                          aggregate_sum: bool = False, fill_na: bool = False) -> pd.Series:
+        """Resample to calendar days, weeks (starting Monday) or months in the timezone tz. 
+        Resampling the same series again after new data was appended is incremental.
+        """
+        return resample_calendar(input_series, period=period, tz=tz, aggregate_sum=aggregate_sum, fill_na=fill_na)
+    
+    @staticmethod
+    def moving_average(input_series: pd.Series, window_points: int = 10) -> pd.Series:
+        """Mean of the last window_points points
+        """
+        output_series = input_series.rolling(window_points).mean()
+        output_series.name += f".ma{window_points}"
+        return output_series
+    
+    @staticmethod
+    def ema(input_series: pd.Series, span_points: float = 10.) -> pd.Series:
+        """Exponential moving average over span_points points
+        """
+        output_series = input_series.ewm(span=span_points).mean()
+        output_series.name += f".ema{span_points:g}"
+        return output_series
+    
+    @staticmethod
+    def median(input_series: pd.Series, window_points: int = 5) -> pd.Series:
+        """Median of the last window_points points
+        """
+        output_series = _rolling_median(input_series, window_points)
+        output_series.name += f".median{window_points}"
+        return output_series
+    
+    @staticmethod
+    def savgol(input_series: pd.Series, window_points: int = 11, polyorder: int = 2) -> pd.Series:
+        """Savitzky-Golay filter: least squares polynomial of polyorder fitted to the centered 
+        window of window_points (odd) points. The first and last window_points // 2 points are NaN.
+        """
+        if window_points % 2 == 0 or polyorder >= window_points:
+            raise ValueError(f"{window_points=} must be odd and greater than {polyorder=}")
+        half = window_points // 2
+        vander = np.vander(np.arange(-half, half + 1), polyorder + 1, increasing=True)
+        coeffs = np.linalg.pinv(vander)[0]  # the fitted polynomial at the window center
+        values = input_series.to_numpy(dtype=np.float64)
+        output_values = np.full(len(values), np.nan)
+        if len(values) >= window_points:
+            output_values[half:len(values) - half] = np.convolve(values, coeffs[::-1], mode="valid")
+        return pd.Series(output_values, index=input_series.index, 
+                         name=f"{input_series.name}.savgol{window_points}_{polyorder}")
+    
+    @staticmethod
+    def lowpass(input_series: pd.Series, cutoff_hours: float = 1.) -> pd.Series:
+        """First order low-pass filter with a time constant of cutoff_hours, also for irregularly
+        sampled series
+        """
+        output_series = input_series.ewm(halflife=dt.timedelta(hours=cutoff_hours) * np.log(2), 
+                                         times=input_series.index).mean()
+        output_series.name += f".lp{cutoff_hours:g}h"
+        return output_series
+    
+    @staticmethod
+    def clip_outliers(input_series: pd.Series, window_points: int = 11, n_sigmas: float = 3.) -> pd.Series:
+        """Clips points deviating more than n_sigmas from the median of the centered window of 
+        window_points points (Hampel filter, the sigma is estimated from the median absolute 
+        deviation). The first and last window_points // 2 points aren't clipped.
+        """
+        rolling_median = _rolling_median(input_series, window_points, center=True)
+        sigma = 1.4826 * _rolling_median((input_series - rolling_median).abs(), window_points, center=True)
+        output_series = input_series.clip(rolling_median - n_sigmas * sigma, rolling_median + n_sigmas * sigma)
+        output_series.name = f"{input_series.name}.clip{window_points}_{n_sigmas:g}sigma"
+        return output_series
+    
     
 class SignalTransformersInterface():
     """Interface to the SignalTransformers
@@ -75,4 +174,15 @@ if __name__ == "__main__":
     for transformer_name in tfi.get_transformers_names():
         print(f"{transformer_name=}")
         for param in tfi.get_transformer_parameters(transformer_name):
-            print("-", param)
\ No newline at end of file
+            print("-", param)
+    
+    if "benchmark" in sys.argv:
+        n_points = 10_000_000
+        rng = np.random.default_rng(0)
+        series = pd.Series(rng.normal(size=n_points).cumsum(), name="signal",
+                           index=pd.date_range("2020-01-01", periods=n_points, freq="10s", tz="UTC"))
+        print(f"\nFilters on {n_points:,} points:")
+        for transformer_name in ("moving_average", "ema", "median", "savgol", "lowpass", "clip_outliers"):
+            t0 = time.perf_counter()
+            output_series = tfi.get_transformer(transformer_name)(input_series=series)
+            print(f"{output_series.name:<24} {time.perf_counter() - t0:.2f}s")
\ No newline at end of file
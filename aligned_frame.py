@@ -0,0 +1,247 @@
+"""Module providing batched transformer kernels for many series aligned on a common time index
+
+The series are aligned once into a 2D block (one row per series, one column per timestamp of
+the union of all indices) with a mask of the points present in each series. diff, cumsum and
+resample then run as one NumPy operation over the block and return exactly what the
+SignalTransformers return per series.
+
+This pays off where the per-series overhead of pandas dominates: resample, and diff and cumsum
+of many short series. pandas runs diff and cumsum of a long series as a single NumPy call,
+the block is slower then (see the benchmark below).
+"""
+
+import time
+import numpy as np
+import pandas as pd
+from typing import Optional
+
+# the block has len(union) columns per series, which pays off only for (nearly) common indices
+MAX_UNION_GROWTH = 1.1  # union length / length of the longest series
+# mean series length up to which the block is faster than the per-series transformers
+MAX_MEAN_POINTS = {"diff": 500, "cumsum": 500, "resample": 100_000}
+
+
+def _ffill_positions(mask: np.ndarray) -> np.ndarray:
+    """Returns for each element the position of the last True in its row of mask at or before
+    it (-1 if none)
+    """
+    positions = np.where(mask, np.arange(mask.shape[1]), -1)
+    return np.maximum.accumulate(positions, axis=1)
+
+
+def _get_nanoseconds(index: pd.DatetimeIndex) -> np.ndarray:
+    return pd.DatetimeIndex(index).as_unit("ns").asi8
+
+
+class AlignmentIndex():
+    """Union of the time indices of several series, plus the positions of each series points
+    in the union. Series sharing an index object (common cadence) are aligned only once.
+    """
+    def __init__(self, indices: list) -> None:
+        self.tz = indices[0].tz if len(indices) else None
+        self.name = indices[0].name if len(indices) else None
+        distinct = dict()
+        for index in indices:
+            if id(index) not in distinct:
+                distinct[id(index)] = _get_nanoseconds(index)
+        times = list()
+        for t in distinct.values():
+            if not any(len(t) == len(other) and np.array_equal(t, other) for other in times):
+                times.append(t)
+        if len(times) == 1:
+            self.times = times[0]
+        else:  # the indices are sorted, so a stable sort merges them
+            union = np.sort(np.concatenate(times), kind="stable")
+            self.times = union[np.r_[True, union[1:] != union[:-1]]]
+        self.positions = list()
+        for index in indices:
+            t = distinct[id(index)]
+            # a series as long as the union covers it, no search needed
+            self.positions.append(slice(None) if len(t) == len(self.times) else np.searchsorted(self.times, t))
+
+    def get_index(self, times: np.ndarray = None) -> pd.DatetimeIndex:
+        times = self.times if times is None else times
+        index = pd.DatetimeIndex(times.view("datetime64[ns]"), name=self.name)
+        return index if self.tz is None else index.tz_localize("UTC").tz_convert(self.tz)
+
+
+class AlignedFrame():
+    """Numeric series aligned as rows of a 2D block, points missing in a series are masked
+    """
+    def __init__(self, alignment: AlignmentIndex, times: np.ndarray, block: np.ndarray, present: np.ndarray,
+                 names: list) -> None:
+        self.alignment = alignment
+        self.times = times
+        self.block = block
+        self.present = present
+        self.full = present.all(axis=1)  # the series having all points, these don't need masking
+        self.names = names
+
+    @classmethod
+    def from_series(cls, series_list: list, alignment: AlignmentIndex) -> "AlignedFrame":
+        block = np.empty((len(series_list), len(alignment.times)))
+        present = np.ones(block.shape, dtype=bool)
+        for row, (series, positions) in enumerate(zip(series_list, alignment.positions)):
+            if isinstance(positions, slice):
+                block[row] = series.to_numpy(dtype=np.float64)
+            else:
+                block[row] = np.nan
+                block[row, positions] = series.to_numpy(dtype=np.float64)
+                present[row] = False
+                present[row, positions] = True
+        return cls(alignment, alignment.times, block, present, [series.name for series in series_list])
+
+    def to_series_list(self) -> list:
+        """Returns the series, the values are views of the block (not copied)
+        """
+        index = self.alignment.get_index(self.times)
+        series_list = list()
+        for row, name in enumerate(self.names):
+            if self.full[row]:
+                series_list.append(pd.Series(self.block[row], index=index, name=name, copy=False))
+            else:
+                present = self.present[row]
+                series_list.append(pd.Series(self.block[row, present], index=index[present], name=name,
+                                             copy=False))
+        return series_list
+
+    def _derive(self, block: np.ndarray, suffix: str, times: np.ndarray = None,
+                present: np.ndarray = None) -> "AlignedFrame":
+        return AlignedFrame(self.alignment, self.times if times is None else times, block,
+                            self.present if present is None else present, [f"{name}{suffix}" for name in self.names])
+
+    def diff(self) -> "AlignedFrame":
+        """Difference to the previous point of the same series (like pandas.Series.diff)
+        """
+        block = np.empty_like(self.block)
+        block[:, 0] = np.nan
+        np.subtract(self.block[:, 1:], self.block[:, :-1], out=block[:, 1:])
+        if not self.full.all():  # the previous point of masked series may be further back
+            partial = ~self.full
+            previous = _ffill_positions(self.present[partial])[:, :-1]
+            values = self.block[partial]
+            previous_values = np.take_along_axis(values, np.maximum(previous, 0), axis=1)
+            block[partial, 1:] = np.where(previous >= 0, values[:, 1:] - previous_values, np.nan)
+        return self._derive(block, ".diff")
+
+    def cumsum(self) -> "AlignedFrame":
+        """Cumulative sum skipping NaNs (like pandas.Series.cumsum)
+        """
+        block = np.cumsum(self.block, axis=1)
+        nan_rows = np.isnan(block[:, -1]) if block.shape[1] else []  # NaN propagates to the end
+        if np.any(nan_rows):
+            values = self.block[nan_rows]
+            nan = np.isnan(values)
+            block[nan_rows] = np.where(nan, np.nan, np.cumsum(np.where(nan, 0., values), axis=1))
+        return self._derive(block, ".cumsum")
+
+    def resample(self, interval_hours: int = 24, aggregate_sum: bool = False, fill_na: bool = False) -> "AlignedFrame":
+        """Resample to buckets of interval_hours (like SignalTransformers.resample).
+
+        interval_hours must divide a day: pandas aligns the buckets to the first midnight of
+        each series, which only then gives the same buckets for all series. Like in pandas, the
+        buckets have a fixed length, also across DST changes.
+        """
+        if interval_hours <= 0 or 24 % interval_hours:
+            raise ValueError(f"{interval_hours=} doesn't divide a day")
+        bucket_ns = interval_hours * 3600 * 10**9
+        suffix = f".sum{int(interval_hours)}h" if aggregate_sum else f".mean{int(interval_hours)}h"
+        if not len(self.times):
+            return self._derive(self.block, suffix)
+
+        # pandas starts the buckets at the (local) midnight of the first point of each series
+        has_points = self.present.any(axis=1)
+        first_times = self.alignment.get_index(self.times[np.argmax(self.present[has_points], axis=1)])
+        origins = _get_nanoseconds(first_times.normalize())
+        if len(origins) and np.any((origins - origins[0]) % bucket_ns):
+            raise ValueError("The series buckets aren't aligned (different UTC offsets at their first midnight)")
+        origin = origins[0] if len(origins) else 0
+        buckets = (self.times - origin) // bucket_ns
+        all_buckets = np.arange(buckets[0], buckets[-1] + 1)
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        columns = buckets[starts] - buckets[0]
+
+        shape = (len(self.block), len(all_buckets))
+        valid = ~np.isnan(self.block)
+        sums = np.zeros(shape)
+        sums[:, columns] = np.add.reduceat(np.where(valid, self.block, 0.), starts, axis=1)
+        if aggregate_sum:
+            block = sums
+        else:
+            counts = np.zeros(shape)
+            counts[:, columns] = np.add.reduceat(valid, starts, axis=1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                block = sums / counts
+            if fill_na:
+                filled = _ffill_positions(~np.isnan(block))
+                block = np.where(filled >= 0, np.take_along_axis(block, np.maximum(filled, 0), axis=1), np.nan)
+
+        # each series covers the buckets from its first to its last point
+        present_buckets = np.zeros(shape, dtype=bool)
+        present_buckets[:, columns] = np.logical_or.reduceat(self.present, starts, axis=1)
+        first = np.argmax(present_buckets, axis=1)[:, None]
+        last = shape[1] - 1 - np.argmax(present_buckets[:, ::-1], axis=1)[:, None]
+        present = (np.arange(shape[1]) >= first) & (np.arange(shape[1]) <= last) & has_points[:, None]
+
+        times = origin + all_buckets * bucket_ns
+        return self._derive(block, suffix, times, present)
+
+
+def transform_aligned(series_list: list, transformer_name: str, params: dict) -> Optional[list]:
+    """Returns the transformed series_list computed on one aligned block, or None if the
+    transformer or its parameters have no batched kernel, the series are too long for the block
+    to be faster (see MAX_MEAN_POINTS) or the indices differ too much (use the per-series 
+    transformers then)
+    """
+    if transformer_name not in MAX_MEAN_POINTS or not series_list:
+        return None
+    if sum(map(len, series_list)) > MAX_MEAN_POINTS[transformer_name] * len(series_list):
+        return None
+    if transformer_name == "resample":
+        hours = params.get("interval_hours")
+        if not isinstance(hours, int) or hours <= 0 or 24 % hours:
+            return None
+    if any(series.dtype.kind not in "biuf" or not isinstance(series.index, pd.DatetimeIndex)
+           for series in series_list):
+        return None
+    if len({str(series.index.tz) for series in series_list}) > 1:
+        return None
+    alignment = AlignmentIndex([series.index for series in series_list])
+    if len(alignment.times) > MAX_UNION_GROWTH * max(len(series) for series in series_list):
+        return None  # e.g. different cadences, mostly NaN rows, the per-series loop is faster
+    frame = AlignedFrame.from_series(series_list, alignment)
+    try:
+        return getattr(frame, transformer_name)(**params).to_series_list()
+    except ValueError:
+        return None
+
+
+if __name__ == "__main__":
+    from SignalTransformer import SignalTransformersInterface
+
+    interface = SignalTransformersInterface()
+    rng = np.random.default_rng(0)
+    for n_series, n_points in ((3000, 500), (500, 10_000), (20, 500_000)):
+        index = pd.date_range("2024-01-01", periods=n_points, freq="1min", tz="UTC", name="time")
+        series_list = [pd.Series(rng.normal(size=n_points).cumsum(), index=index, name=f"meter_{i}")
+                       for i in range(n_series)]
+        series_list.append(series_list[0].iloc[::7].rename("sparse"))  # a subset of the common index
+
+        for transformer_name, params in (("diff", {}), ("cumsum", {}),
+                                         ("resample", {"interval_hours": 1, "aggregate_sum": False, "fill_na": True}),
+                                         ("resample", {"interval_hours": 24, "aggregate_sum": True, "fill_na": False})):
+            t0 = time.perf_counter()
+            expected = [interface.get_transformer(transformer_name)(input_series=series, **params)
+                        for series in series_list]
+            t1 = time.perf_counter()
+            alignment = AlignmentIndex([series.index for series in series_list])
+            results = getattr(AlignedFrame.from_series(series_list, alignment), transformer_name)(**params).to_series_list()
+            t2 = time.perf_counter()
+            for result, exp in zip(results, expected):
+                pd.testing.assert_series_equal(result, exp, check_freq=False, check_index_type=False)
+            used = transform_aligned(series_list, transformer_name, params) is not None
+            print(f"{expected[0].name:>17} {len(series_list)} x {n_points:,}: per-series loop {t1 - t0:.3f}s, "
+                  f"aligned {t2 - t1:.3f}s ({'used' if used else 'not used'} by transform_aligned)")
+
+    shifted = [series.shift(freq="30s").rename("shifted") for series in series_list[:2]]  # union of 2x the points
+    assert transform_aligned(series_list[:2] + shifted, "resample", {"interval_hours": 1}) is None
@@ -0,0 +1,217 @@
+"""Benchmark of the apps hot paths on synthetic data served by a local fake InfluxDB
+
+Synthetic series of configurable sizes (plus many small entities for the catalog) are served
+by fake_influxdb.FakeInfluxDB and run through the same code as the app: catalog load, raw and
+aggregated queries, conversion of the rows to series, SignalTransformers, JsonEnc/JsonDec round
+trips and TracesHandler.get_traces_figures. The best time of --repeat runs of each stage is
+compared to the stored baseline (benchmark_baseline.json), --save replaces the baseline.
+
+    python benchmark.py                           # compare the default sizes to the baseline
+    python benchmark.py --sizes 10k,1M,10M,50M    # larger sizes, up to 50M points
+    python benchmark.py --save                    # store the results as new baseline
+
+The times depend on the machine, so compare baselines saved on the same machine only.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import datetime as dt
+import numpy as np
+import pandas as pd
+from influxdb import InfluxDBClient
+from fake_influxdb import FakeInfluxDB
+from entity_catalog import load_catalog
+from influx_loader import raw_to_series, query_series
+from query_planner import QueryPlanner
+from json_encoder_decoder import JsonEnc, JsonEncFast, JsonDec
+from SignalTransformer import SignalTransformersInterface
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+START = dt.datetime(2010, 1, 1)
+CADENCE_SECONDS = 10
+MAX_RAW_QUERY_POINTS = 1_000_000  # the fake server answers with one JSON document
+MAX_READABLE_JSON_POINTS = 1_000_000  # JsonEnc writes a Timestamp object per point
+# resample_calendar is left out, it's incremental and would only be timed once
+TRANSFORMERS = ("diff", "cumsum", "resample", "moving_average", "ema", "median", "savgol", "lowpass",
+                "clip_outliers")
+SIZE_SUFFIXES = {"k": 10**3, "M": 10**6}
+
+
+def parse_size(size: str) -> int:
+    """Returns the number of points of a size like '10k', '50M' or '2000'
+    """
+    size = size.strip()
+    if size[-1:] in SIZE_SUFFIXES:
+        return int(float(size[:-1]) * SIZE_SUFFIXES[size[-1]])
+    return int(size)
+
+
+def format_size(n_points: int) -> str:
+    for suffix, factor in reversed(SIZE_SUFFIXES.items()):
+        if n_points >= factor and n_points % factor == 0:
+            return f"{n_points // factor}{suffix}"
+    return str(n_points)
+
+
+def make_series(n_points: int, name: str = None, seed: int = 0) -> pd.Series:
+    """Returns a meter-like random walk with 0.01 resolution and a few gaps (missing points)
+    """
+    rng = np.random.default_rng(seed)
+    n_gaps = n_points // 10_000
+    index = pd.date_range(START, periods=n_points + n_gaps, freq=f"{CADENCE_SECONDS}s", tz="UTC", name="time", unit="ns")
+    index = index.delete(np.sort(rng.choice(np.arange(1, len(index) - 1), n_gaps, replace=False)))
+    return pd.Series(np.round(rng.normal(size=n_points).cumsum(), 2), index=index, name=name)
+
+
+def make_database(sizes: list, n_entities: int) -> dict:
+    """Returns the fake database: one entity per size plus n_entities small ones
+    """
+    units = ("kWh", "W", "°C", "%", "V", "A")
+    small = make_series(10, "sensor")
+    entities = {(units[i % len(units)], f"sensor_{i}"): small for i in range(n_entities)}
+    for n_points in sizes:
+        entity_id = f"meter_{format_size(n_points)}"
+        entities[("kWh", entity_id)] = make_series(n_points, entity_id)
+    return entities
+
+
+class Timer():
+    """Keeps the best time of each stage over repeated runs
+    """
+    def __init__(self, repeat: int = 3) -> None:
+        self.repeat = repeat
+        self.results = dict()  # stage: seconds
+
+    def run(self, stage: str, function, repeat: int = None):
+        """Runs function repeat times and returns its last result
+        """
+        for _ in range(repeat or self.repeat):
+            t0 = time.perf_counter()
+            result = function()
+            seconds = time.perf_counter() - t0
+            self.results[stage] = min(seconds, self.results.get(stage, np.inf))
+        print(f"{stage:<40} {self.results[stage]:9.4f}s", flush=True)
+        return result
+
+
+def time_figures(series: pd.Series, timer: Timer, stage: str) -> None:
+    """Times TracesHandler.get_traces_figures (without figure cache) for one trace of series
+    """
+    import streamlit as st
+    from streamlit_app import Trace, TracesHandler
+    # streamlit in bare mode: session_state works, but warns about the missing script context
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)
+
+    st.session_state["traces"] = list()
+    handler = TracesHandler()
+    handler.add_trace(Trace(entity="meter", unit="kWh", series=series))
+
+    def get_figures():
+        st.session_state.pop("figure_cache", None)
+        return handler.get_traces_figures(max_points=2000)
+    timer.run(stage, get_figures)
+    st.session_state["traces"] = list()
+
+
+def run(sizes: list, n_entities: int, repeat: int) -> dict:
+    """Runs all stages and returns {stage: best seconds}
+    """
+    timer = Timer(repeat)
+    interface = SignalTransformersInterface()
+    print(f"generating {n_entities} entities and series of {', '.join(map(format_size, sizes))} points", flush=True)
+    database = make_database(sizes, n_entities)
+    with FakeInfluxDB({"bench": database}) as fake:
+        client = InfluxDBClient(port=fake.port, database="bench")
+        catalog = timer.run(f"catalog load/{n_entities}", lambda: load_catalog(client))
+        assert len(catalog) == len(database)
+
+        for n_points in sizes:
+            size = format_size(n_points)
+            entity_id = f"meter_{size}"
+            series = database[("kWh", entity_id)]
+            raw_points = min(n_points, MAX_RAW_QUERY_POINTS)
+            first, last = (time_stamp.tz_localize(None).to_pydatetime() for time_stamp in series.index[[0, -1]])
+            raw_stop = series.index[raw_points - 1].tz_localize(None).to_pydatetime() + dt.timedelta(seconds=1)
+            raw_plan = QueryPlanner().plan("kWh", entity_id, first, raw_stop, "raw")
+            raw = timer.run(f"{size}/query raw {format_size(raw_points)}",
+                            lambda: client.query(raw_plan.get_query_string(), epoch="ns").raw)
+            queried = timer.run(f"{size}/rows to series {format_size(raw_points)}", lambda: raw_to_series(raw))
+            assert len(queried) == raw_points
+            aggregated_plan = QueryPlanner(max_points=5000).plan("kWh", entity_id, first, 
+                                                                 last + dt.timedelta(seconds=1), "auto")
+            timer.run(f"{size}/query aggregated", lambda: query_series(client, aggregated_plan.get_query_string()))
+
+            for transformer_name in TRANSFORMERS:
+                transformer = interface.get_transformer(transformer_name)
+                timer.run(f"{size}/transformer {transformer_name}", lambda: transformer(input_series=series))
+
+            trace = {"entity": entity_id, "unit": "kWh", "series": series}
+            text = timer.run(f"{size}/JsonEncFast", lambda: json.dumps(trace, cls=JsonEncFast))
+            decoded = timer.run(f"{size}/JsonDec (packed)", lambda: json.loads(text, cls=JsonDec))
+            pd.testing.assert_series_equal(decoded["series"], series, check_freq=False)
+            if n_points <= MAX_READABLE_JSON_POINTS:
+                text = timer.run(f"{size}/JsonEnc (readable)", lambda: json.dumps(trace, cls=JsonEnc))
+                timer.run(f"{size}/JsonDec (readable)", lambda: json.loads(text, cls=JsonDec))
+            del text, decoded
+
+            time_figures(series, timer, f"{size}/get_traces_figures")
+        client.close()
+    return timer.results
+
+
+def get_environment() -> dict:
+    return {"date": dt.datetime.now().isoformat(timespec="seconds"), "machine": platform.machine(),
+            "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Prints results next to the baseline and returns the stages slower by more than tolerance
+    """
+    regressions = list()
+    print(f"\n{'stage':<40} {'seconds':>9} {'baseline':>9} {'ratio':>6}")
+    for stage, seconds in results.items():
+        base = baseline["results"].get(stage)
+        if base is None:
+            print(f"{stage:<40} {seconds:9.4f} {'-':>9}")
+            continue
+        ratio = seconds / base if base else np.inf
+        flag = ""
+        if ratio > tolerance and seconds - base > 0.005:  # ignore jitter of very fast stages
+            regressions.append(stage)
+            flag = "  REGRESSION"
+        print(f"{stage:<40} {seconds:9.4f} {base:9.4f} {ratio:6.2f}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", default="10k,1M", help="comma separated points per series, e.g. 10k,1M,50M")
+    parser.add_argument("--entities", type=int, default=5000, help="number of entities in the catalog")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best is kept")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="store the results as baseline")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="slowdown factor reported as regression")
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    results = run(sizes, args.entities, args.repeat)
+    document = {"environment": get_environment(), "sizes": args.sizes, "entities": args.entities,
+                "results": {stage: round(seconds, 6) for stage, seconds in results.items()}}
+    if args.save:
+        with open(args.baseline, "w") as file:
+            json.dump(document, file, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        print(f"baseline of {baseline['environment']}")
+        if regressions := compare(results, baseline, args.tolerance):
+            print(f"{len(regressions)} stages are more than {args.tolerance}x slower than the baseline")
+            sys.exit(1)
+    else:
+        print(f"no baseline at {args.baseline}, store one with --save")
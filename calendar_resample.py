@@ -0,0 +1,200 @@
+"""Module resampling series to calendar buckets (day, week, month) in a timezone, incrementally
+
+The bucket sums and counts of each resampled series are kept, such that resampling the same
+series again after new points were appended (e.g. by a refresh) only aggregates the points of
+the last (open) bucket and the new ones. A kept state is only reused for a series starting with
+exactly the aggregated points (checked by CRC32 checksums of their times and values), because
+different series may have the same name.
+"""
+
+import time
+import zlib
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from typing import Literal
+from dataclasses import dataclass, field
+
+Period = Literal["day", "week", "month"]
+# bucket period: series name suffix
+PERIODS = {"day": "1d", "week": "1w", "month": "1mo"}
+
+
+def get_bucket_ids(index: pd.DatetimeIndex, period: str, tz: str) -> np.ndarray:
+    """Returns the consecutive int bucket number of each timestamp: days, weeks (starting
+    Monday) or months since the epoch, in local time of tz. Naive timestamps are UTC.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"Unknown {period=}, expected one of {list(PERIODS)}")
+    if index.tz is None:
+        index = index.tz_localize("UTC")
+    local = index.tz_convert(tz).tz_localize(None).as_unit("ns").to_numpy()
+    if period == "month":
+        return local.astype("datetime64[M]").astype(np.int64)
+    days = local.astype("datetime64[D]").astype(np.int64)
+    if period == "week":
+        return (days + 3) // 7  # the epoch was a Thursday
+    return days
+
+
+def get_bucket_labels(ids: np.ndarray, period: str, tz: str) -> pd.DatetimeIndex:
+    """Returns the start (local midnight in tz) of the buckets ids
+    """
+    if period == "month":
+        days = ids.astype("datetime64[M]").astype("datetime64[D]")
+    elif period == "week":
+        days = (ids * 7 - 3).astype("datetime64[D]")
+    else:
+        days = ids.astype("datetime64[D]")
+    labels = pd.DatetimeIndex(days.astype("datetime64[ns]"))
+    return labels.tz_localize(tz, ambiguous=np.zeros(len(labels), dtype=bool), nonexistent="shift_forward")
+
+
+def get_checksums(series: pd.Series, start: int, stop: int, checksums: tuple = (0, 0)) -> tuple:
+    """Returns the CRC32 checksums of the times and values of series.iloc[start:stop],
+    continuing the checksums of series.iloc[:start]
+    """
+    times = np.ascontiguousarray(pd.DatetimeIndex(series.index).asi8[start:stop])  # in the unit of the index
+    values = np.ascontiguousarray(series.to_numpy(dtype=np.float64)[start:stop])
+    return zlib.crc32(times, checksums[0]), zlib.crc32(values, checksums[1])
+
+
+@dataclass
+class BucketState:
+    """Bucket aggregates of the first n_points of a series
+    """
+    first_id: int = 0
+    sums: np.ndarray = field(default=None, repr=False)
+    counts: np.ndarray = field(default=None, repr=False)
+    n_points: int = 0
+    first_time: pd.Timestamp = None
+    last_time: pd.Timestamp = None
+    checksums: tuple = (0, 0)  # of the times and values of the n_points
+    open_position: int = 0  # position of the first point in the last bucket
+
+    def is_prefix_of(self, series: pd.Series) -> bool:
+        """Returns True if series starts with the points aggregated in this state
+        """
+        if self.n_points == 0 or len(series) < self.n_points:
+            return False
+        if series.index[0] != self.first_time or series.index[self.n_points - 1] != self.last_time:
+            return False
+        return get_checksums(series, 0, self.n_points) == self.checksums
+
+
+class CalendarResampler():
+    """Resamples series to calendar buckets, keeping the bucket state of the last max_states
+    series (by name, period and tz) for incremental updates of series starting with the same points
+    """
+    def __init__(self, max_states: int = 64) -> None:
+        self.max_states = max_states
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"full": 0, "incremental": 0, "unchanged": 0}
+
+    def resample(self, series: pd.Series, period: Period = "month", tz: str = "UTC", aggregate_sum: bool = False,
+                 fill_na: bool = False) -> pd.Series:
+        key = (series.name, period, tz)
+        with self._lock:
+            state = self._states.pop(key, None)
+        state = self._update(state, series, period, tz)
+        with self._lock:
+            self._states[key] = state
+            while len(self._states) > self.max_states:
+                self._states.popitem(last=False)
+
+        labels = get_bucket_labels(state.first_id + np.arange(len(state.sums)), period, tz)
+        labels.name = series.index.name
+        if aggregate_sum:
+            output_series = pd.Series(state.sums.copy(), index=labels, name=series.name)
+            output_series.name += f".sum{PERIODS[period]}"
+        else:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                output_series = pd.Series(state.sums / state.counts, index=labels, name=series.name)
+            if fill_na:
+                output_series = output_series.ffill()
+            output_series.name += f".mean{PERIODS[period]}"
+        return output_series
+
+    def _update(self, state: BucketState, series: pd.Series, period: str, tz: str) -> BucketState:
+        if state is not None and state.is_prefix_of(series):
+            if len(series) == state.n_points:
+                self.stats["unchanged"] += 1
+                return state
+            self.stats["incremental"] += 1
+            start = state.open_position  # the open bucket is aggregated again, with the new points
+            kept = len(state.sums) - 1
+            checksums = get_checksums(series, state.n_points, len(series), state.checksums)
+        else:
+            self.stats["full"] += 1
+            state, start, kept = BucketState(), 0, 0
+            checksums = get_checksums(series, 0, len(series))
+
+        tail = series.iloc[start:]
+        if not len(tail):
+            return BucketState(sums=np.zeros(0), counts=np.zeros(0))
+        ids = get_bucket_ids(tail.index, period, tz)
+        values = tail.to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        first_id = ids[0] if start == 0 else state.first_id
+        offsets = ids[valid] - first_id
+        n_buckets = ids[-1] - first_id + 1
+        sums = np.bincount(offsets, weights=values[valid], minlength=n_buckets)[kept:]
+        counts = np.bincount(offsets, minlength=n_buckets)[kept:].astype(np.float64)
+        open_position = start + int(np.searchsorted(ids, ids[-1]))
+        return BucketState(first_id=int(first_id),
+                           sums=np.concatenate([state.sums[:kept], sums]) if kept else sums,
+                           counts=np.concatenate([state.counts[:kept], counts]) if kept else counts,
+                           n_points=len(series), first_time=series.index[0], last_time=series.index[-1],
+                           checksums=checksums, open_position=open_position)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"states": len(self._states), **self.stats}
+
+
+_resampler = CalendarResampler()
+
+
+def resample_calendar(series: pd.Series, period: Period = "month", tz: str = "UTC", aggregate_sum: bool = False,
+                      fill_na: bool = False) -> pd.Series:
+    """Resamples series to calendar buckets, incrementally if it was resampled before
+    """
+    return _resampler.resample(series, period, tz, aggregate_sum, fill_na)
+
+
+def get_stats() -> dict:
+    return _resampler.get_stats()
+
+
+if __name__ == "__main__":
+    tz = "Europe/Berlin"
+    index = pd.date_range("2019-01-01", "2024-01-01", freq="1min", tz="UTC", name="time", inclusive="left")
+    rng = np.random.default_rng(0)
+    series = pd.Series(rng.random(len(index)), index=index, name="energy")
+    series.iloc[rng.choice(len(series), 1000)] = np.nan
+
+    rules = {"day": "D", "week": "W-MON", "month": "MS"}
+    for period, rule in rules.items():
+        expected = series.tz_convert(tz).resample(rule, label="left", closed="left")
+        for aggregate_sum in (False, True):
+            result = resample_calendar(series, period, tz, aggregate_sum)
+            pd.testing.assert_series_equal(result, expected.sum() if aggregate_sum else expected.mean(),
+                                           check_freq=False, check_names=False, check_index_type=False)
+
+    appended = pd.concat([series, pd.Series(rng.random(10), name="energy",
+                                            index=pd.date_range(index[-1], periods=11, freq="1min")[1:])])
+    t0 = time.perf_counter()
+    full = CalendarResampler().resample(appended, "month", tz, aggregate_sum=True)
+    t1 = time.perf_counter()
+    incremental = resample_calendar(appended, "month", tz, aggregate_sum=True)
+    t2 = time.perf_counter()
+    pd.testing.assert_series_equal(incremental, full)
+
+    changed = appended.copy()
+    changed.iloc[100] += 1.  # same name, times and last value, but different content
+    pd.testing.assert_series_equal(resample_calendar(changed, "month", tz, aggregate_sum=True),
+                                   CalendarResampler().resample(changed, "month", tz, aggregate_sum=True))
+    print(f"monthly sums of {len(appended):,} points after appending 10: full {(t1 - t0) * 1000:.1f}ms, "
+          f"incremental {(t2 - t1) * 1000:.1f}ms, {get_stats()}")
@@ -0,0 +1,94 @@
+"""Module reducing time series to a plotting budget of points while keeping their visual shape
+"""
+
+import numpy as np
+import pandas as pd
+
+METHODS = ("lttb", "minmax")
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Returns the indices of the points selected by the largest-triangle-three-buckets algorithm.
+
+    The first and last points are always kept, the others are split into n_out - 2 buckets.
+    Per bucket, the point forming the largest triangle with the previously selected point and
+    the average of the next bucket is selected. x and y must be float arrays without NaNs.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)  # bucket i is edges[i]:edges[i+1]
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    avg_x, avg_y = np.append(avg_x[1:], x[-1]), np.append(avg_y[1:], y[-1])  # the next buckets average
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        bx, by = x[start:stop], y[start:stop]
+        areas = np.abs((x[a] - avg_x[i]) * (by - y[a]) - (x[a] - bx) * (avg_y[i] - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Returns the sorted indices of the min and max point of n_out // 2 equally sized buckets.
+
+    y must not contain NaNs.
+    """
+    n = len(y)
+    n_buckets = n_out // 2
+    if n_out >= n or n_buckets < 1:
+        return np.arange(n)
+
+    size = -(-n // n_buckets)
+    n_buckets = -(-n // size)
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(n_buckets, size)
+    offsets = np.arange(n_buckets) * size
+    indices = np.concatenate([offsets + np.nanargmin(padded, axis=1), offsets + np.nanargmax(padded, axis=1)])
+    return np.unique(indices)
+
+
+def decimate(series: pd.Series, n_out: int, method: str = "lttb") -> pd.Series:
+    """Returns series reduced to about n_out points (NaNs are dropped). Non-numeric series
+    (e.g. on/off states) are reduced to equally spaced positions.
+    """
+    if len(series) <= n_out:
+        return series
+    if method not in METHODS:
+        raise ValueError(f"Unknown {method=}, expected one of {METHODS}")
+    series = series.dropna()
+    if series.dtype.kind not in "biuf":
+        return series.iloc[np.unique(np.linspace(0, len(series) - 1, n_out).astype(np.int64))]
+    y = series.to_numpy(dtype=np.float64)
+    if method == "lttb":
+        index = series.index
+        if isinstance(index, pd.DatetimeIndex):
+            x = index.as_unit("ns").asi8.astype(np.float64)
+        else:
+            x = index.to_numpy(dtype=np.float64)
+        indices = lttb_indices(x, y, n_out)
+    else:
+        indices = minmax_indices(y, n_out)
+    return series.iloc[indices]
+
+
+if __name__ == "__main__":
+    import time
+    for n in (100_000, 1_000_000, 10_000_000):
+        index = pd.date_range("2024-01-01", periods=n, freq="1s", tz="UTC")
+        series = pd.Series(np.sin(np.arange(n) / 1e4) + np.random.default_rng(0).normal(scale=0.1, size=n), index=index)
+        for method in METHODS:
+            t0 = time.perf_counter()
+            decimated = decimate(series, 2000, method)
+            print(f"{n=:>11,} {method=:>8}: {len(decimated)} points in {time.perf_counter() - t0:.3f}s")
+
+    states = pd.Series(np.where(np.arange(3000) % 7, "on", "off"), index=index[:3000])
+    assert len(decimate(states, 2000)) == 2000
@@ -0,0 +1,210 @@
+"""Module providing an indexed catalog of the entities (series) of a database
+
+The catalog is loaded with SHOW TAG VALUES (one query for the domains and one per domain for
+their entity_ids, grouped by measurement which is the unit) instead of parsing the keys of
+SHOW SERIES. Lookups by entity_id, unit and domain are hash based, searches by prefix and
+substring run on a sorted list and a joined string. CatalogStore keeps the catalogs per database
+and refreshes them in the background when they're older than their time-to-live.
+"""
+
+import re
+import time
+import bisect
+import threading
+import numpy as np
+import pandas as pd
+from typing import Callable, Hashable
+from influxdb import InfluxDBClient
+
+
+class EntityCatalog():
+    """Entities of a database as (unit, domain, entity_id) records with indexes
+    """
+    def __init__(self, records: list) -> None:
+        self.records = list(records)
+        self.loaded_at = time.time()
+        self._by_entity_id, self._by_unit, self._by_domain = dict(), dict(), dict()
+        for row, (unit, domain, entity_id) in enumerate(self.records):
+            self._by_entity_id.setdefault(entity_id, list()).append(row)
+            self._by_unit.setdefault(unit, list()).append(row)
+            self._by_domain.setdefault(domain, list()).append(row)
+        self._sorted_ids = sorted(self._by_entity_id, key=str.lower)
+        self._lower_ids = [entity_id.lower() for entity_id in self._sorted_ids]
+        # one string of all lower case entity_ids for substring searches at C speed
+        self._haystack = "\n".join(self._lower_ids)
+        self._offsets = np.cumsum([0] + [len(entity_id) + 1 for entity_id in self._sorted_ids[:-1]])
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __contains__(self, entity_id: str) -> bool:
+        return entity_id in self._by_entity_id
+
+    def get_units(self) -> list:
+        return list(self._by_unit)
+
+    def get_domains(self) -> list:
+        return list(self._by_domain)
+
+    def get_unit(self, entity_id: str) -> str:
+        """Returns the unit of entity_id (the first one, if it's stored in several units)
+        """
+        return self.records[self._by_entity_id[entity_id][0]][0]
+
+    def get_entity_ids(self, unit: str = None, domain: str = None) -> list:
+        """Returns the entity_ids, optionally only those of unit and/or domain
+        """
+        if unit is None and domain is None:
+            return [entity_id for _, _, entity_id in self.records]
+        rows = self._by_unit.get(unit, []) if unit is not None else self._by_domain.get(domain, [])
+        return [self.records[row][2] for row in rows if domain is None or self.records[row][1] == domain]
+
+    def search(self, text: str, unit: str = None) -> list:
+        """Returns the entity_ids starting with text, followed by those containing it elsewhere
+        (case insensitive), optionally only those of unit
+        """
+        text = text.lower()
+        if not text:
+            return self.get_entity_ids(unit)
+        first = bisect.bisect_left(self._lower_ids, text)
+        prefixed = list()
+        for row in range(first, len(self._lower_ids)):
+            if not self._lower_ids[row].startswith(text):
+                break
+            prefixed.append(self._sorted_ids[row])
+        positions = [match.start() for match in re.finditer(re.escape(text), self._haystack)]
+        rows = np.unique(np.searchsorted(self._offsets, positions, side="right") - 1)
+        found = set(prefixed)
+        containing = [self._sorted_ids[row] for row in rows if self._sorted_ids[row] not in found]
+        entity_ids = prefixed + containing
+        if unit is not None:
+            entity_ids = [entity_id for entity_id in entity_ids
+                          if any(self.records[row][0] == unit for row in self._by_entity_id[entity_id])]
+        return entity_ids
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame.from_records(self.records, columns=["unit", "domain", "entity_id"])
+
+
+def parse_tag_values(raw: dict, domain: str) -> list:
+    """Returns the (unit, domain, entity_id) records of a raw SHOW TAG VALUES result
+    """
+    records = list()
+    for series in raw.get("series", []):
+        records.extend((series["name"], domain, value) for _, value in series["values"])
+    return records
+
+
+def load_catalog(client: InfluxDBClient) -> EntityCatalog:
+    """Returns the catalog of the clients current database
+    """
+    raw = client.query('SHOW TAG VALUES WITH KEY = "domain"').raw
+    domains = sorted({value for series in raw.get("series", []) for _, value in series["values"]})
+    records = list()
+    for domain in domains:
+        domain_string = domain.replace("'", "\\'")
+        raw = client.query(f"""SHOW TAG VALUES WITH KEY = "entity_id" WHERE "domain" = '{domain_string}'""").raw
+        records.extend(parse_tag_values(raw, domain))
+    return EntityCatalog(records)
+
+
+class CatalogStore():
+    """Catalogs by key (e.g. (host, port, database)), loaded once and refreshed in a background
+    thread when older than ttl seconds. Meanwhile, the old catalog is returned.
+    """
+    def __init__(self, ttl: float = 600.) -> None:
+        self.ttl = ttl
+        self._catalogs = dict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._stats = {"loads": 0, "background_refreshes": 0, "errors": 0}
+
+    def get(self, key: Hashable, loader: Callable[[], EntityCatalog]) -> EntityCatalog:
+        with self._lock:
+            catalog = self._catalogs.get(key)
+            if catalog is not None:
+                if time.time() - catalog.loaded_at > self.ttl and key not in self._refreshing:
+                    self._refreshing.add(key)
+                    threading.Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+                return catalog
+        catalog = loader()  # the first load of a key blocks, concurrent first loads are harmless
+        with self._lock:
+            self._stats["loads"] += 1
+            self._catalogs[key] = catalog
+        return catalog
+
+    def _refresh(self, key: Hashable, loader: Callable[[], EntityCatalog]) -> None:
+        try:
+            catalog = loader()
+            with self._lock:
+                self._catalogs[key] = catalog
+                self._stats["background_refreshes"] += 1
+        except Exception as e:
+            print(f"Refreshing the entity catalog {key} failed: {e!r}")
+            with self._lock:
+                self._stats["errors"] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._catalogs.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"catalogs": {str(key): len(catalog) for key, catalog in self._catalogs.items()},
+                    "refreshing": len(self._refreshing), **self._stats}
+
+
+_store = CatalogStore()
+
+
+def get_catalog_store() -> CatalogStore:
+    """Returns the process-wide catalog store, shared by all sessions and the pre-warming
+    (see startup.py)
+    """
+    return _store
+
+
+if __name__ == "__main__":
+    from fake_influxdb import FakeInfluxDB
+
+    def parse_show_series(client: InfluxDBClient) -> pd.DataFrame:  # the former way, for comparison
+        records = list()
+        for point in ["unit=" + p["key"].replace("\\", "") for p in client.query("show series").get_points()]:
+            record = dict()
+            for item in point.split(","):
+                key, value = item.split("=")
+                record[key] = value
+            records.append(record)
+        return pd.DataFrame.from_records(records)
+
+    index = pd.date_range("2024-01-01", periods=1, freq="1min", tz="UTC")
+    units = ("kWh", "W", "°C", "%", "V", "A", "km")
+    entities = {(units[i % len(units)], f"sensor_{i}_{units[i % len(units)]}"): pd.Series([0.], index=index)
+                for i in range(20_000)}
+    with FakeInfluxDB({"home": entities}) as fake:
+        client = InfluxDBClient(port=fake.port, database="home")
+        t0 = time.perf_counter()
+        frame = parse_show_series(client)
+        t1 = time.perf_counter()
+        catalog = load_catalog(client)
+        t2 = time.perf_counter()
+        client.close()
+    print(f"{len(catalog)} entities: show series parsed in {t1 - t0:.3f}s, catalog loaded in {t2 - t1:.3f}s")
+
+    entity_ids = frame["entity_id"].sample(1000, random_state=0).tolist()
+    t0 = time.perf_counter()
+    units_frame = [next(iter(frame[frame["entity_id"] == entity_id]["unit"])) for entity_id in entity_ids]
+    t1 = time.perf_counter()
+    units_catalog = [catalog.get_unit(entity_id) for entity_id in entity_ids]
+    t2 = time.perf_counter()
+    assert units_frame == units_catalog
+    print(f"1000 unit lookups: dataframe scan {t1 - t0:.3f}s, catalog {t2 - t1:.5f}s")
+
+    t0 = time.perf_counter()
+    found = catalog.search("_1234")
+    print(f"search '_1234': {found[:3]}... {len(found)} found in {time.perf_counter() - t0:.5f}s")
+    assert catalog.search("sensor_1234_")[0].startswith("sensor_1234_")
+    assert set(catalog.search("_1234")) == {e for e in catalog.get_entity_ids() if "_1234" in e}
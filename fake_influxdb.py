@@ -0,0 +1,235 @@
+"""Module providing a minimal in-process fake of the InfluxDB 1.x HTTP API for local checks
+and benchmarks without a database
+
+Only the statements used by the app are understood: SHOW DATABASES, SHOW SERIES,
+SHOW MEASUREMENTS, SHOW TAG VALUES WITH KEY = "domain" | "entity_id" (optionally WHERE "domain" = '...')
+and SELECT value, mean_value of a single entity, optionally GROUP BY time() aggregated (mean, min,
+max, last, sum) or transformed (difference, cumulative_sum).
+"""
+
+import re
+import json
+import time
+import threading
+import numpy as np
+import pandas as pd
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SELECT_PATTERN = re.compile(r"""SELECT (?P<fields>.+?) FROM "(?P<measurement>[^"]+)" WHERE entity_id = '(?P<entity_id>[^']+)'"""
+                            r""" AND time >= '(?P<start>[^']+)' AND time < '(?P<stop>[^']+)'"""
+                            r"""( GROUP BY time\((?P<bucket>\w+)\) fill\(none\))?""")
+
+TAG_VALUES_PATTERN = re.compile(r"""SHOW TAG VALUES WITH KEY = "(?P<key>domain|entity_id)"(?: WHERE "domain" = '(?P<domain>[^']*)')?""",
+                                re.IGNORECASE)
+
+DURATION_SECONDS = {"w": 7*86400, "d": 86400, "h": 3600, "m": 60, "s": 1}
+
+
+def parse_duration(duration: str) -> int:
+    """Returns the seconds of an InfluxQL duration literal like '15m'
+    """
+    return int(duration[:-1]) * DURATION_SECONDS[duration[-1]]
+
+
+def aggregate(times: np.ndarray, values: np.ndarray, bucket_ns: int, function: str) -> tuple:
+    """Returns (bucket_times, aggregated_values) of sorted epoch-ns times for non-empty buckets
+    """
+    buckets = times // bucket_ns
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]]) if len(times) else np.array([], dtype=int)
+    if function == "mean":
+        counts = np.diff(np.r_[starts, len(values)])
+        aggregated = np.add.reduceat(values, starts) / counts if len(starts) else values[:0]
+    elif function == "min":
+        aggregated = np.minimum.reduceat(values, starts) if len(starts) else values[:0]
+    elif function == "max":
+        aggregated = np.maximum.reduceat(values, starts) if len(starts) else values[:0]
+    elif function == "sum":
+        aggregated = np.add.reduceat(values, starts) if len(starts) else values[:0]
+    elif function == "last":
+        aggregated = values[np.r_[starts[1:] - 1, len(values) - 1]] if len(starts) else values[:0]
+    else:
+        raise ValueError(f"Unsupported aggregation {function=}")
+    return buckets[starts] * bucket_ns, aggregated
+
+
+class FakeInfluxDB():
+    """Fake InfluxDB server serving pandas.Series with datetime index.
+
+    databases maps database names to dicts of {(unit, entity_id): series}.
+    Each query is answered after delay seconds, to simulate a slow database.
+    """
+    def __init__(self, databases: dict = None, delay: float = 0., domain: str = "sensor") -> None:
+        self.databases = databases if databases is not None else dict()
+        self.delay = delay
+        self.domain = domain
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._counters = {"connections": 0, "requests": 0, "queries": 0, "max_concurrent_queries": 0}
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self, port: int = 0) -> int:
+        """Starts serving on localhost in a background thread, returns the port
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def setup(self):
+                super().setup()
+                fake._count("connections")
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                fake._count("requests")
+                if url.path == "/ping":
+                    self.send_response(204)
+                    self.send_header("X-Influxdb-Version", "1.8-fake")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                elif url.path == "/query":
+                    params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                    body = json.dumps(fake.query(params.get("q", ""), params.get("db"),
+                                                 params.get("epoch"))).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self.send_error(404)
+
+            do_POST = do_GET
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+    def query(self, qstr: str, database: str = None, epoch: str = None) -> dict:
+        """Returns the response document for the query string
+        """
+        with self._lock:
+            self._counters["queries"] += 1
+            self._active += 1
+            self._counters["max_concurrent_queries"] = max(self._counters["max_concurrent_queries"], self._active)
+        try:
+            time.sleep(self.delay)
+            return {"results": [self._execute(" ".join(qstr.split()), database, epoch)]}
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _execute(self, qstr: str, database: str, epoch: str) -> dict:
+        result = {"statement_id": 0}
+        if qstr.lower() == "show databases":
+            result["series"] = [{"name": "databases", "columns": ["name"],
+                                 "values": [[name] for name in self.databases]}]
+            return result
+
+        if database not in self.databases:
+            result["error"] = f"database not found: {database}"
+            return result
+
+        if qstr.lower() == "show series":
+            keys = [[f"{unit},domain={self.domain},entity_id={entity_id}"]
+                    for unit, entity_id in self.databases[database]]
+            result["series"] = [{"columns": ["key"], "values": keys}]
+            return result
+
+        if qstr.lower() == "show measurements":
+            units = sorted({unit for unit, _ in self.databases[database]})
+            if units:
+                result["series"] = [{"name": "measurements", "columns": ["name"], "values": [[u] for u in units]}]
+            return result
+
+        if (match := TAG_VALUES_PATTERN.fullmatch(qstr)) is not None:
+            entity_ids = dict()  # unit: entity_ids
+            if match["domain"] in (None, self.domain):
+                for unit, entity_id in self.databases[database]:
+                    entity_ids.setdefault(unit, list()).append(entity_id)
+            tag_values = {unit: [[match["key"], self.domain if match["key"] == "domain" else entity_id] 
+                                 for entity_id in ids[:1 if match["key"] == "domain" else None]]
+                          for unit, ids in sorted(entity_ids.items())}
+            if tag_values:
+                result["series"] = [{"name": unit, "columns": ["key", "value"], "values": values}
+                                    for unit, values in tag_values.items()]
+            return result
+
+        match = SELECT_PATTERN.fullmatch(qstr)
+        if match is None:
+            result["error"] = f"fake InfluxDB doesn't understand: {qstr}"
+            return result
+        series = self.databases[database].get((match["measurement"], match["entity_id"]))
+        if series is None:
+            return result
+
+        times = series.index.as_unit("ns").asi8
+        values = series.to_numpy(dtype=np.float64)
+        start, stop = (pd.Timestamp(match[key]).as_unit("ns").value for key in ("start", "stop"))
+        first, last = times.searchsorted(start, "left"), times.searchsorted(stop, "left")
+        times, values = times[first:last], values[first:last]
+        function = re.match(r"(\w+)\(", match["fields"])
+        if match["bucket"] is not None:
+            times, values = aggregate(times, values, parse_duration(match["bucket"]) * 10**9, function[1])
+        elif function is not None and function[1] == "difference":
+            times, values = times[1:], np.diff(values)
+        elif function is not None and function[1] == "cumulative_sum":
+            values = np.cumsum(values)
+        if not len(times):
+            return result
+
+        if epoch == "ns":
+            time_column = times.tolist()
+        else:
+            time_column = pd.to_datetime(times, unit="ns").strftime("%Y-%m-%dT%H:%M:%S.%fZ").tolist()
+        result["series"] = [{"name": match["measurement"], "columns": ["time", "value", "mean_value"],
+                             "values": [[t, v, None] for t, v in zip(time_column, values.tolist())]}]
+        return result
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+
+if __name__ == "__main__":
+    from influxdb import InfluxDBClient
+
+    index = pd.date_range("2024-01-01", periods=1000, freq="1min", tz="UTC")
+    databases = {"home": {("kWh", "meter"): pd.Series(np.arange(1000.), index=index)}}
+    with FakeInfluxDB(databases) as fake:
+        client = InfluxDBClient(port=fake.port, database="home")
+        print(client.get_list_database())
+        print(list(client.query("show series").get_points()))
+        print(list(client.query("""SELECT mean(value) AS value, mean(mean_value) AS mean_value FROM "kWh"
+                                   WHERE entity_id = 'meter' AND time >= '2024-01-01T00:00:00Z'
+                                   AND time < '2024-01-01T01:00:00Z' GROUP BY time(15m) fill(none)""").get_points()))
+        client.close()
+        print(fake.get_stats())
@@ -0,0 +1,96 @@
+"""Module loading InfluxDB query results column-wise into pandas.Series with datetime index
+
+InfluxDB returns the points of a series as columns + rows of values. Instead of building one
+dict per point (ResultSet.get_points) and parsing ISO time strings, the rows are transposed
+once and converted to NumPy arrays, with the time requested as epoch nanoseconds.
+"""
+
+import numpy as np
+import pandas as pd
+from influxdb import InfluxDBClient
+from instrumentation import RunRecorder
+
+
+def raw_to_series(raw: dict, name: str = None) -> pd.Series:
+    """Converts the raw result of a single InfluxDB statement into a pandas.Series.
+
+    The result must have been queried with epoch="ns". Like the dict-records path, the first
+    field column without missing values becomes the series (either value or mean_value
+    should be None). An empty series is returned, if there is no such column.
+    """
+    empty_series = pd.Series(dtype=float, name=name, index=pd.DatetimeIndex([], tz="UTC", name="time"))
+    if not raw.get("series"):
+        return empty_series
+    table = raw["series"][0]
+    if not table.get("values"):
+        return empty_series
+
+    columns = dict(zip(table["columns"], zip(*table["values"])))
+    index = pd.to_datetime(np.array(columns.pop("time"), dtype=np.int64), unit="ns", utc=True)
+    index.name = "time"
+    for column in columns.values():
+        try:
+            values = np.array(column, dtype=np.float64)  # None -> NaN
+        except (TypeError, ValueError):
+            values = np.array(column, dtype=object)
+            if not any(value is None for value in column):
+                return pd.Series(values, index=index, name=name)
+            continue
+        if not np.isnan(values).any():
+            return pd.Series(values, index=index, name=name)
+    return empty_series
+
+
+def query_series(client: InfluxDBClient, qstr: str, name: str = None, recorder: RunRecorder = None) -> pd.Series:
+    """Runs the query and returns its result as pandas.Series. The data query and the conversion
+    of its rows are recorded as stages of the recorder, if given.
+    """
+    if recorder is None:
+        return raw_to_series(client.query(qstr, epoch="ns").raw, name=name)
+    with recorder.stage("data query") as timing:
+        raw = client.query(qstr, epoch="ns").raw
+        timing.rows = sum(len(table.get("values") or ()) for table in raw.get("series", ()))
+    with recorder.stage("rows to series") as timing:
+        series = raw_to_series(raw, name=name)
+        timing.add_result(series)
+    return series
+
+
+if __name__ == "__main__":
+    import time
+    from influxdb.resultset import ResultSet
+
+    def records_to_series(raw: dict, name: str = None) -> pd.Series:
+        """The dict-records path as used in streamlit_app.py before, for comparison
+        """
+        df = pd.DataFrame.from_records(ResultSet(raw).get_points())
+        df.time = pd.to_datetime(df.time)
+        df = df.set_index("time")
+        df = df.dropna(axis=1)
+        series = df[df.columns[0]]
+        series.name = name
+        return series
+
+    def make_raw(n: int, epoch: bool) -> dict:
+        times = pd.date_range("2024-01-01", periods=n, freq="10s", tz="UTC")
+        if epoch:
+            times = times.as_unit("ns").asi8.tolist()
+        else:
+            times = times.strftime("%Y-%m-%dT%H:%M:%SZ").tolist()
+        values = np.random.default_rng(0).normal(size=n).tolist()
+        return {"statement_id": 0,
+                "series": [{"name": "kWh", "columns": ["time", "value", "mean_value"],
+                            "values": [[t, v, None] for t, v in zip(times, values)]}]}
+
+    for n in (10_000, 100_000, 1_000_000):
+        raw_iso, raw_epoch = make_raw(n, epoch=False), make_raw(n, epoch=True)
+
+        t0 = time.perf_counter()
+        records = records_to_series(raw_iso, "bench")
+        t1 = time.perf_counter()
+        columnar = raw_to_series(raw_epoch, "bench")
+        t2 = time.perf_counter()
+
+        assert (records.index == columnar.index).all() and np.array_equal(records.values, columnar.values)
+        print(f"{n=:>9,}: get_points {t1 - t0:7.3f}s, columnar {t2 - t1:7.3f}s, "
+              f"speedup {(t1 - t0) / (t2 - t1):5.1f}x")
@@ -0,0 +1,166 @@
+"""Module providing a bounded pool of long-lived InfluxDB clients, shared by all sessions of the app
+
+Each pooled InfluxDBClient keeps its requests.Session (HTTP keep-alive) across script runs.
+A client is handed out exclusively, because switch_database() changes the clients state.
+"""
+
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from influxdb import InfluxDBClient
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class InfluxClientPool():
+    """Bounded pool of InfluxDBClients.
+
+    Idle clients are health-checked with a ping before being handed out, if they haven't
+    been used for health_check_seconds. Clients failing the check are replaced.
+    """
+    def __init__(self, host: str, port: int, username: str = "root", password: str = "root",
+                 size: int = 4, acquire_timeout: float = 30., health_check_seconds: float = 30.,
+                 **client_kwargs) -> None:
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_seconds = health_check_seconds
+        self._client_kwargs = dict(host=host, port=port, username=username, password=password,
+                                   pool_size=1, **client_kwargs)  # one keep-alive connection per client
+        self._idle = list()     # (client, last_used) tuples, most recently used last
+        self._in_use = set()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._counters = {"created": 0, "acquired": 0, "reused": 0, "waits": 0, "timeouts": 0,
+                          "health_checks": 0, "failed_health_checks": 0, "discarded": 0}
+
+    def acquire(self, database: str = None) -> InfluxDBClient:
+        """Returns a client for exclusive use, waits up to acquire_timeout if all are in use
+        """
+        if not self._slots.acquire(blocking=False):
+            self._count("waits")
+            if not self._slots.acquire(timeout=self.acquire_timeout):
+                self._count("timeouts")
+                raise PoolTimeoutError(f"All {self.size} InfluxDB clients are in use")
+        try:
+            client = self._get_healthy_client()
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use.add(client)
+            self._counters["acquired"] += 1
+        if database is not None:
+            client.switch_database(database)
+        return client
+
+    def release(self, client: InfluxDBClient, discard: bool = False) -> None:
+        """Returns the client into the pool, discard=True closes it instead (e.g. after errors)
+        """
+        with self._lock:
+            self._in_use.discard(client)
+            if discard or self._closed:
+                self._counters["discarded"] += discard
+                client.close()
+            else:
+                self._idle.append((client, time.monotonic()))
+        self._slots.release()
+
+    @contextmanager
+    def client(self, database: str = None):
+        client = self.acquire(database)
+        discard = False
+        try:
+            yield client
+        except Exception:
+            discard = True
+            raise
+        finally:  # also on BaseExceptions like streamlits RerunException
+            self.release(client, discard=discard)
+
+    def close(self) -> None:
+        """Closes all idle clients, clients in use are closed on release
+        """
+        with self._lock:
+            self._closed = True
+            for client, _ in self._idle:
+                client.close()
+            self._idle = list()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(size=self.size, in_use=len(self._in_use), idle=len(self._idle))
+            return stats
+
+    def _get_healthy_client(self) -> InfluxDBClient:
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("InfluxClientPool is closed")
+                if not self._idle:
+                    self._counters["created"] += 1
+                    return InfluxDBClient(**self._client_kwargs)
+                client, last_used = self._idle.pop()
+                self._counters["reused"] += 1
+            if time.monotonic() - last_used < self.health_check_seconds:
+                return client
+            self._count("health_checks")
+            try:
+                client.ping()
+                return client
+            except Exception:
+                self._count("failed_health_checks")
+                client.close()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+
+_pools = dict()
+_pools_lock = threading.Lock()
+
+
+def get_pool(host: str, port: int, username: str = "root", password: str = "root", **kwargs) -> InfluxClientPool:
+    """Returns the process-wide pool for the given server and credentials
+    """
+    key = (host, port, username, password)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = InfluxClientPool(host, port, username, password, **kwargs)
+        return _pools[key]
+
+
+@atexit.register
+def close_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+
+
+if __name__ == "__main__":
+    import numpy as np
+    import pandas as pd
+    from concurrent.futures import ThreadPoolExecutor
+    from fake_influxdb import FakeInfluxDB
+
+    index = pd.date_range("2024-01-01", periods=100, freq="1min", tz="UTC")
+    databases = {"home": {("kWh", "meter"): pd.Series(np.arange(100.), index=index)}}
+    with FakeInfluxDB(databases, delay=0.05) as fake:
+        pool = get_pool("localhost", fake.port, size=3)
+
+        def script_run(_) -> int:
+            with pool.client("home") as client:
+                return len(client.get_list_database()) + len(list(client.query("show series").get_points()))
+
+        # 50 script runs on 8 threads share 3 clients, see test_influx_pool.py for the checks
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(script_run, range(50)))
+
+        print("pool:", pool.get_stats())
+        print("fake server:", fake.get_stats())
+        close_pools()
@@ -0,0 +1,193 @@
+"""Module recording per-stage timings of the app runs (wall time, rows and bytes per stage)
+
+A RunRecorder collects the stages of one run (rerun of the streamlit script), also from
+worker threads. Finished runs are summed up by Metrics, which exports them as JSON or in
+the Prometheus text format. ProfileCapture profiles a single run with cProfile (or with
+pyinstrument, if installed).
+"""
+
+import io
+import json
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from query_cache import estimate_bytes
+
+
+@dataclass
+class StageStats:
+    calls: int = 0
+    seconds: float = 0.
+    rows: int = 0
+    bytes: int = 0
+
+
+class StageTiming():
+    """Yielded by RunRecorder.stage, to add the rows and bytes processed by the stage
+    """
+    __slots__ = ("rows", "nbytes")
+
+    def __init__(self) -> None:
+        self.rows = 0
+        self.nbytes = 0
+
+    def add_result(self, result) -> None:
+        """Adds the rows (length) and estimated bytes of result (e.g. a series)
+        """
+        self.rows += len(result)
+        self.nbytes += estimate_bytes(result)
+
+
+class RunRecorder():
+    """Records the stages of a run. Stages may nest (e.g. transformers while building figures),
+    then the time of the inner stage is included in the outer one as well.
+    """
+    def __init__(self) -> None:
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.seconds = None  # total run time, once finished
+        self.stages = dict()  # name: StageStats, in order of the first call
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        timing = StageTiming()
+        t0 = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            seconds = time.perf_counter() - t0
+            with self._lock:
+                stats = self.stages.setdefault(name, StageStats())
+                stats.calls += 1
+                stats.seconds += seconds
+                stats.rows += timing.rows
+                stats.bytes += timing.nbytes
+
+    def finish(self) -> None:
+        self.seconds = time.perf_counter() - self._t0
+
+    def get_elapsed(self) -> float:
+        return self.seconds if self.seconds is not None else time.perf_counter() - self._t0
+
+    def to_records(self) -> list:
+        """Returns a list of dicts (one per stage) e.g. for a dataframe
+        """
+        with self._lock:
+            return [{"stage": name, **asdict(stats), "seconds": round(stats.seconds, 4)}
+                    for name, stats in self.stages.items()]
+
+
+class Metrics():
+    """Thread-safe sums of the stages of all finished runs of the process
+    """
+    def __init__(self, prefix: str = "streamlit_db_browser") -> None:
+        self.prefix = prefix
+        self.runs = 0
+        self.run_seconds = 0.
+        self.stages = dict()
+        self.last_run = None
+        self._lock = threading.Lock()
+
+    def add_run(self, recorder: RunRecorder) -> None:
+        with self._lock:
+            self.runs += 1
+            self.run_seconds += recorder.get_elapsed()
+            for name, stats in recorder.stages.items():
+                total = self.stages.setdefault(name, StageStats())
+                total.calls += stats.calls
+                total.seconds += stats.seconds
+                total.rows += stats.rows
+                total.bytes += stats.bytes
+            self.last_run = recorder
+
+    def to_json(self) -> str:
+        with self._lock:
+            last_run = self.last_run
+            document = {"runs": self.runs, "run_seconds": self.run_seconds,
+                        "stages": {name: asdict(stats) for name, stats in self.stages.items()}}
+        if last_run is not None:
+            document["last_run"] = {"started": last_run.started, "seconds": last_run.get_elapsed(),
+                                    "stages": last_run.to_records()}
+        return json.dumps(document, indent=2)
+
+    def to_prometheus(self) -> str:
+        """Returns the sums in the Prometheus text exposition format
+        """
+        lines = [f"# TYPE {self.prefix}_runs_total counter",
+                 f"# TYPE {self.prefix}_run_seconds_total counter"]
+        with self._lock:
+            lines += [f"{self.prefix}_runs_total {self.runs}",
+                      f"{self.prefix}_run_seconds_total {self.run_seconds:.6f}"]
+            for metric in ("calls", "seconds", "rows", "bytes"):
+                lines.append(f"# TYPE {self.prefix}_stage_{metric}_total counter")
+                for name, stats in self.stages.items():
+                    label = name.replace("\\", "\\\\").replace('"', '\\"')
+                    value = getattr(stats, metric)
+                    value = f"{value:.6f}" if isinstance(value, float) else value
+                    lines.append(f'{self.prefix}_stage_{metric}_total{{stage="{label}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+class ProfileCapture():
+    """Profiles the code between start() and stop() with cProfile or pyinstrument
+    """
+    PROFILERS = ("cProfile", "pyinstrument")
+
+    def __init__(self, profiler: str = "cProfile") -> None:
+        if profiler not in self.PROFILERS:
+            raise ValueError(f"Unknown {profiler=}, expected one of {self.PROFILERS}")
+        self.profiler = profiler
+        self._profile = None
+
+    @staticmethod
+    def get_available() -> list:
+        try:
+            import pyinstrument  # optional
+            return list(ProfileCapture.PROFILERS)
+        except ImportError:
+            return ["cProfile"]
+
+    def start(self) -> None:
+        if self.profiler == "pyinstrument":
+            from pyinstrument import Profiler
+            self._profile = Profiler()
+            self._profile.start()
+        else:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self, top: int = 40) -> str:
+        """Stops profiling and returns the report (the top functions by cumulative time)
+        """
+        if self.profiler == "pyinstrument":
+            self._profile.stop()
+            return self._profile.output_text(unicode=True)
+        self._profile.disable()
+        stream = io.StringIO()
+        pstats.Stats(self._profile, stream=stream).sort_stats("cumulative").print_stats(top)
+        return stream.getvalue()
+
+
+if __name__ == "__main__":
+    import numpy as np
+    import pandas as pd
+
+    metrics = Metrics()
+    capture = ProfileCapture()
+    capture.start()
+    for _ in range(3):
+        recorder = RunRecorder()
+        with recorder.stage("data query") as timing:
+            series = pd.Series(np.random.default_rng(0).random(100_000))
+            timing.add_result(series)
+        with recorder.stage("transformers") as timing:
+            timing.add_result(series.cumsum())
+        recorder.finish()
+        metrics.add_run(recorder)
+    print(capture.stop(top=5))
+    print(pd.DataFrame(recorder.to_records()))
+    print(metrics.to_prometheus())
@@ -0,0 +1,200 @@
+"""Module providing incremental interval fetching: the [start, stop) segments already loaded per
+entity are remembered, so that only the missing gaps of a requested interval are queried
+"""
+
+import threading
+import dataclasses
+import numpy as np
+import pandas as pd
+from typing import Callable
+from query_cache import QueryCache
+from query_planner import QueryPlan
+
+
+def to_utc(timestamp) -> pd.Timestamp:
+    """Returns timestamp as UTC pandas.Timestamp (naive timestamps are considered UTC)
+    """
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is None:
+        return timestamp.tz_localize("UTC")
+    return timestamp.tz_convert("UTC")
+
+
+class SegmentedSeries():
+    """A series together with the sorted, non-overlapping [start, stop) segments it covers
+    """
+    def __init__(self) -> None:
+        self.series = None
+        self.segments = list()
+        self.fetched_at = None  # time of the last fetch reaching up to "now"
+        self.open_from = None    # data after this timestamp was incomplete at fetched_at
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated memory of the series, for the QueryCache budget
+        """
+        series_bytes = 0 if self.series is None else int(np.sum(self.series.memory_usage(index=True, deep=False)))
+        return series_bytes + 64 * (len(self.segments) + 1)
+
+    def get_gaps(self, start: pd.Timestamp, stop: pd.Timestamp) -> list:
+        """Returns the [start, stop) intervals within [start, stop) which are not covered yet
+        """
+        gaps = list()
+        for seg_start, seg_stop in self.segments:
+            if seg_stop <= start:
+                continue
+            if seg_start >= stop:
+                break
+            if seg_start > start:
+                gaps.append((start, seg_start))
+            start = max(start, seg_stop)
+        if start < stop:
+            gaps.append((start, stop))
+        return gaps
+
+    def add(self, series: pd.Series, start: pd.Timestamp, stop: pd.Timestamp) -> None:
+        """Merges series covering [start, stop) into the existing data
+        """
+        if self.series is None or not len(self.series):
+            self.series = series
+        elif len(series):
+            merged = pd.concat([self.series, series])
+            merged = merged[~merged.index.duplicated(keep="last")]
+            self.series = merged.sort_index()
+
+        segments = sorted(self.segments + [(start, stop)])
+        self.segments = [segments[0]]
+        for seg_start, seg_stop in segments[1:]:
+            last_start, last_stop = self.segments[-1]
+            if seg_start <= last_stop:
+                self.segments[-1] = (last_start, max(last_stop, seg_stop))
+            else:
+                self.segments.append((seg_start, seg_stop))
+
+    def forget_after(self, timestamp: pd.Timestamp) -> None:
+        """Drops data and coverage at and after timestamp, such that it gets fetched again
+        """
+        if self.series is not None:
+            self.series = self.series[self.series.index < timestamp]
+        self.segments = [(start, min(stop, timestamp)) for start, stop in self.segments if start < timestamp]
+        self.fetched_at = None
+
+    def get_slice(self, start: pd.Timestamp, stop: pd.Timestamp) -> pd.Series:
+        index = self.series.index
+        return self.series.iloc[index.searchsorted(start, "left"):index.searchsorted(stop, "left")]
+
+
+class IntervalStore():
+    """Incremental data fetching on top of the QueryCache.
+
+    Data is kept per key (one entity with one aggregation) as SegmentedSeries in the cache.
+    Aggregated intervals are widened to whole GROUP BY time() buckets, and the bucket
+    containing "now" is never considered complete. Gaps ending at "now" are fetched
+    again at most every refresh_seconds, unless refresh() is called.
+
+    Only intervals of the same key are fetched incrementally, i.e. raw queries and
+    aggregations with an unchanged bucket size (see get_key).
+    """
+    def __init__(self, cache: QueryCache, refresh_seconds: float = 60.) -> None:
+        self.cache = cache
+        self.refresh_seconds = refresh_seconds
+        self._counters = {"requests": 0, "fully_cached": 0, "gap_queries": 0}
+
+    @staticmethod
+    def get_key(prefix: tuple, plan: QueryPlan) -> tuple:
+        """Returns the cache key of the plans data. It includes the bucket size, so a plan with
+        another bucket size (e.g. "auto" for a wider interval) fetches its whole interval again:
+        means of finer buckets can't be aggregated to the means of coarser ones.
+        """
+        return ("segments",) + prefix + (plan.measurement, plan.entity_id, plan.aggregation, plan.bucket_seconds)
+
+    def get_series(self, key: tuple, plan: QueryPlan, loader: Callable[[QueryPlan], pd.Series],
+                   now: pd.Timestamp = None) -> pd.Series:
+        """Returns the series for the plans [start, stop) interval, calling the loader
+        with a modified plan for each gap that hasn't been loaded before
+        """
+        now = to_utc(now if now is not None else pd.Timestamp.now(tz="UTC"))
+        start, stop = to_utc(plan.start), to_utc(plan.stop)
+        if not plan.is_raw():
+            bucket = pd.Timedelta(seconds=plan.bucket_seconds)
+            start, stop = start.floor(bucket), stop.ceil(bucket)
+            complete_until = now.floor(bucket)
+        else:
+            complete_until = now
+
+        segmented = self.cache.get(key, "data", SegmentedSeries)
+        with segmented.lock:
+            self._counters["requests"] += 1
+            gaps = segmented.get_gaps(start, stop)
+            recently_fetched = (segmented.fetched_at is not None and
+                                (now - segmented.fetched_at).total_seconds() < self.refresh_seconds)
+            if recently_fetched:
+                gaps = [(gap_start, gap_stop) for gap_start, gap_stop in gaps if gap_start < segmented.open_from]
+            if not gaps:
+                self._counters["fully_cached"] += 1
+
+            for gap_start, gap_stop in gaps:
+                gap_plan = dataclasses.replace(plan, start=gap_start.tz_localize(None).to_pydatetime(),
+                                               stop=gap_stop.tz_localize(None).to_pydatetime())
+                self._counters["gap_queries"] += 1
+                covered_stop = max(gap_start, min(gap_stop, complete_until))
+                segmented.add(loader(gap_plan), gap_start, covered_stop)
+                if gap_stop > complete_until:
+                    segmented.fetched_at, segmented.open_from = now, covered_stop
+
+            if segmented.series is None:
+                return pd.Series(dtype=float, index=pd.DatetimeIndex([], tz="UTC", name="time"))
+            result = segmented.get_slice(start, stop)
+
+        self.cache.put(key, "data", segmented)  # update the cached size (see nbytes), may evict others
+        return result
+
+    def refresh(self, key: tuple) -> None:
+        """Makes the next get_series fetch everything after the last loaded timestamp
+        """
+        segmented = self.cache.get(key, "data", SegmentedSeries)
+        with segmented.lock:
+            if segmented.series is not None and len(segmented.series):
+                segmented.forget_after(segmented.series.index[-1])
+            else:
+                segmented.fetched_at = None
+
+    def get_stats(self) -> dict:
+        return dict(self._counters)
+
+
+if __name__ == "__main__":
+    import datetime as dt
+
+    def fake_loader(plan: QueryPlan) -> pd.Series:
+        index = pd.date_range(to_utc(plan.start), to_utc(plan.stop), freq="1h", inclusive="left",
+                              name="time").as_unit("ns")
+        print(f"  query {plan.start} .. {plan.stop}")
+        return pd.Series(np.arange(len(index), dtype=float), index=index)
+
+    store = IntervalStore(QueryCache())
+    stop = dt.datetime(2024, 6, 1)
+    for days in (30, 365, 365):
+        plan = QueryPlan("kWh", "meter", stop - dt.timedelta(days=days), stop)
+        print(f"{days=}")
+        series = store.get_series(IntervalStore.get_key((), plan), plan, fake_loader, now=dt.datetime(2024, 7, 1))
+        assert len(series) == days * 24
+
+    print("stop in the future, fetched twice within refresh_seconds and after refresh()")
+    plan = QueryPlan("kWh", "meter", stop - dt.timedelta(days=1), stop + dt.timedelta(days=1))
+    key = IntervalStore.get_key((), plan)
+    for now in (stop, stop + dt.timedelta(seconds=10)):
+        store.get_series(key, plan, fake_loader, now=now)
+    store.refresh(key)
+    store.get_series(key, plan, fake_loader, now=stop + dt.timedelta(seconds=20))
+    print(store.get_stats())
+
+    print("loaded series count for the cache budget")
+    small_cache = QueryCache(max_bytes=2**20)
+    small_store = IntervalStore(small_cache)
+    for entity_id in ("a", "b", "c"):
+        plan = QueryPlan("kWh", entity_id, stop - dt.timedelta(days=365 * 5), stop)  # 700 kB each
+        small_store.get_series(IntervalStore.get_key((), plan), plan, fake_loader, now=dt.datetime(2024, 7, 1))
+    assert small_cache.get_stats()["bytes"] <= 2**20 and small_cache.get_stats()["evictions"] == 2
+    print(small_cache.get_stats())
@@ -1,7 +1,9 @@
 import numpy as np
 import pandas as pd
 import datetime as dt
+import base64
 import json
+from typing import Iterator
 
 
 class JsonEnc(json.JSONEncoder):
@@ -68,6 +70,9 @@ class JsonDec(json.JSONDecoder):
     datetime.datetime    | @datetime
     datetime.timedelta   | @timedelta
     
+    as well as the columnar encodings of the JsonEncFast (@DataFrame.b64, @Series.b64, 
+    @np.array.b64), which are decoded into arrays in one step.
+    
     Of course, the regular JSON datatypes are supported, too:
         int, float, str, bool, None, list, (tuple), dict
         
@@ -104,4 +109,149 @@ class JsonDec(json.JSONDecoder):
             if "@timedelta" in dct:
                 return dt.timedelta(seconds=dct["@timedelta"])
             
-        return dct    
\ No newline at end of file
+            if "@np.array.b64" in dct:
+                return unpack_array(dct["@np.array.b64"])
+            
+            if "@Series.b64" in dct:
+                return pd.Series(data=unpack_array(dct["@Series.b64"]["data"]),
+                                 name=dct["@Series.b64"]["name"],
+                                 index=unpack_index(dct["@Series.b64"]["index"]),
+                                 copy=False)
+            
+            if "@DataFrame.b64" in dct:
+                columns = dct["@DataFrame.b64"]["columns"]
+                data = {idx: unpack_array(packed) for idx, packed in enumerate(dct["@DataFrame.b64"]["data"])}
+                df = pd.DataFrame(data=data, index=unpack_index(dct["@DataFrame.b64"]["index"]), copy=False)
+                df.columns = columns
+                return df
+            
+        return dct
+
+
+def pack_array(array: np.ndarray) -> dict:
+    """Returns a numeric array as dict with dtype tag and base64 packed buffer
+    """
+    array = np.ascontiguousarray(array)
+    return {"dtype": array.dtype.str, "b64": base64.b64encode(array).decode("ascii")}
+
+
+def unpack_array(packed: dict) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(packed["b64"]), dtype=np.dtype(packed["dtype"]))
+
+
+def pack_index(index: pd.Index) -> dict:
+    """Returns an index as dict, datetime indices as epoch nanoseconds with timezone
+    """
+    if isinstance(index, pd.DatetimeIndex):
+        packed = pack_array(index.as_unit("ns").asi8)
+        packed["datetime"] = True
+        packed["tz"] = None if index.tz is None else str(index.tz)
+    elif index.dtype.kind in "biuf":
+        packed = pack_array(index.to_numpy())
+    else:
+        packed = {"list": index.tolist()}
+    packed["name"] = index.name
+    return packed
+
+
+def unpack_index(packed: dict) -> pd.Index:
+    if "list" in packed:
+        return pd.Index(packed["list"], name=packed["name"])
+    values = unpack_array(packed)
+    if packed.get("datetime"):
+        index = pd.DatetimeIndex(values.view("datetime64[ns]"), name=packed["name"])
+        if packed["tz"] is not None:
+            index = index.tz_localize("UTC").tz_convert(packed["tz"])
+        return index
+    return pd.Index(values, name=packed["name"])
+
+
+def is_numeric(obj) -> bool:
+    return obj.dtype.kind in "biuf"
+
+
+class JsonEncFast(JsonEnc):
+    """
+    JsonEnc with columnar encoding of numeric pandas and numpy data: indices as epoch
+    nanoseconds and data as base64 packed buffers with dtype tags. This is much faster and
+    smaller than lists of Python objects, but not human readable.
+    
+    Additional datatype  | keyword
+    ---------------------|------------
+    pandas DataFrame     | @DataFrame.b64 (all columns numeric, else @DataFrame)
+    pandas Series        | @Series.b64 (numeric data, else @Series)
+    numpy array          | @np.array.b64 (numeric data, else @np.array)
+    
+    The JsonDec decodes both, the fast and the regular encoding.
+    """
+    def default(self, obj):
+        if isinstance(obj, pd.DataFrame) and all(is_numeric(obj[col]) for col in obj.columns):
+            return {"@DataFrame.b64": {"columns": list(obj.columns),
+                                       "index": pack_index(obj.index),
+                                       "data": [pack_array(obj[col].to_numpy()) for col in obj.columns]}}
+        
+        if isinstance(obj, pd.Series) and is_numeric(obj):
+            return {"@Series.b64": {"name": obj.name,
+                                    "index": pack_index(obj.index),
+                                    "data": pack_array(obj.to_numpy())}}
+        
+        if isinstance(obj, np.ndarray) and obj.ndim == 1 and is_numeric(obj):
+            return {"@np.array.b64": pack_array(obj)}
+        
+        return super().default(obj)
+
+
+class JsonTracesWriter():
+    """
+    Writes a traces file incrementally, one trace at a time, to a text file object.
+    
+    The file is a regular JSON document {**header, "content": [trace, ...]} with each trace
+    on its own line, so that iter_json_traces can read it back trace by trace.
+    
+    Example usage:
+        with open("traces.json", "w") as file, JsonTracesWriter(file, header) as writer:
+            for trace in traces:
+                writer.write(trace)
+    """
+    def __init__(self, file, header: dict, cls: type = JsonEncFast) -> None:
+        self._file = file
+        self._cls = cls
+        self._count = 0
+        prefix = json.dumps(header)[:-1]  # without the closing "}"
+        self._file.write(prefix + (", " if header else "") + '"content": [\n')
+
+    def write(self, obj) -> None:
+        line = json.dumps(obj, cls=self._cls)
+        self._file.write(("" if self._count == 0 else ",\n") + line)
+        self._count += 1
+
+    def close(self) -> None:
+        self._file.write("\n]}\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_json_traces(file) -> Iterator:
+    """Yields the decoded traces of a file written by JsonTracesWriter one by one.
+    
+    Works on text and binary file objects, only one trace is kept in memory at a time.
+    """
+    decoder = JsonDec()
+    for idx, line in enumerate(file):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if idx == 0:
+            if not line.endswith('"content": ['):
+                raise ValueError("Not a traces file written by JsonTracesWriter")
+            continue
+        if line == "]}":
+            return
+        if not line:  # between "[" and "]}" of a file without traces
+            continue
+        yield decoder.decode(line.removesuffix(","))
+    
\ No newline at end of file
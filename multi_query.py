@@ -0,0 +1,69 @@
+"""Module running the data queries of many entities concurrently in a bounded thread pool
+"""
+
+import time
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from query_planner import QueryPlan
+
+
+@dataclass
+class QueryResult:
+    plan: QueryPlan
+    series: pd.Series = field(default=None, repr=False)
+    error: Exception = None
+    seconds: float = 0.
+
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def query_concurrently(plans: list, loader: Callable[[QueryPlan], pd.Series],
+                       max_workers: int = 4) -> Iterator[QueryResult]:
+    """Calls the loader for each plan in a thread pool and yields QueryResults as they complete.
+
+    A failing query doesn't stop the others, its exception is returned in QueryResult.error.
+    """
+    def timed_loader(plan: QueryPlan) -> QueryResult:
+        t0 = time.perf_counter()
+        try:
+            return QueryResult(plan=plan, series=loader(plan), seconds=time.perf_counter() - t0)
+        except Exception as e:
+            return QueryResult(plan=plan, error=e, seconds=time.perf_counter() - t0)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="multi_query") as executor:
+        futures = [executor.submit(timed_loader, plan) for plan in plans]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+if __name__ == "__main__":
+    import numpy as np
+    import datetime as dt
+    from fake_influxdb import FakeInfluxDB
+    from influx_pool import InfluxClientPool
+    from influx_loader import query_series
+
+    index = pd.date_range("2024-01-01", periods=10_000, freq="1min", tz="UTC")
+    entities = [f"meter_{i}" for i in range(12)]
+    databases = {"home": {("kWh", entity_id): pd.Series(np.arange(10_000.), index=index) for entity_id in entities}}
+    start, stop = dt.datetime(2024, 1, 1), dt.datetime(2024, 1, 8)
+    plans = [QueryPlan("kWh", entity_id, start, stop) for entity_id in entities + ["missing"]]
+
+    with FakeInfluxDB(databases, delay=0.2) as fake:
+        pool = InfluxClientPool("localhost", fake.port, size=6)
+
+        def loader(plan: QueryPlan) -> pd.Series:
+            if plan.entity_id == "missing":
+                raise KeyError(plan.entity_id)
+            with pool.client("home") as client:
+                return query_series(client, plan.get_query_string())
+
+        t0 = time.perf_counter()
+        for result in query_concurrently(plans, loader, max_workers=6):
+            print(f"{result.plan.entity_id:>10}: {result.seconds:.3f}s, "
+                  f"{len(result.series) if result.ok() else repr(result.error)}")
+        print(f"total {time.perf_counter() - t0:.3f}s for {len(plans)} queries, each delayed by {fake.delay}s")
+        pool.close()
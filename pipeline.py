@@ -0,0 +1,101 @@
+"""Module evaluating derived traces lazily: a derived trace is a reference to a source series
+plus an ordered list of transformer steps, evaluated on demand and cached with eviction
+"""
+
+import json
+import pandas as pd
+from typing import Callable, Optional
+from instrumentation import RunRecorder
+from query_cache import QueryCache
+from SignalTransformer import SignalTransformersInterface
+
+
+def make_step(transformer_name: str, params: dict) -> dict:
+    return {"transformer": transformer_name, "params": dict(params)}
+
+
+def get_series_fingerprint(series: pd.Series) -> tuple:
+    """Returns a cheap fingerprint of the series content: data buffer address, length and
+    first and last timestamp. Slices (views) of unchanged data keep their fingerprint.
+    """
+    if not len(series):
+        return (0, )
+    address = series.to_numpy().__array_interface__["data"][0]
+    return (address, len(series), series.index[0], series.index[-1])
+
+
+class PipelineEvaluator():
+    """Evaluates transformer steps on source series.
+
+    The results of all step prefixes are cached, such that derived traces sharing the first
+    steps (e.g. a trace derived from a derived trace) reuse them. Evicted results are simply
+    evaluated again.
+    
+    The optional pushdown(step) callable may return the result of the first step computed
+    elsewhere (e.g. by the database), or None to apply the transformer to the source series.
+    The steps applied (not the cached ones) are recorded as "transformers" stage of the
+    recorder, if given.
+    """
+    def __init__(self, cache: QueryCache, interface: SignalTransformersInterface) -> None:
+        self.cache = cache
+        self.interface = interface
+
+    def get_series(self, source_uid: str, source_series: pd.Series, steps: list,
+                   pushdown: Callable = None, recorder: RunRecorder = None) -> pd.Series:
+        if not steps:
+            return source_series
+        if pushdown is not None and (pushed_series := pushdown(steps[0])) is not None:
+            pushed_uid = f"{source_uid}:{json.dumps(steps[0], sort_keys=True)}"
+            return self.get_series(pushed_uid, pushed_series, steps[1:], recorder=recorder)
+        key = self._get_key(source_uid, source_series, steps)
+        return self.cache.get(key, "derived", lambda: self._apply(source_uid, source_series, steps, recorder))
+
+    def get_pending(self, source_uid: str, source_series: pd.Series, steps: list,
+                    pushdown: Callable = None, recorder: RunRecorder = None) -> Optional[tuple]:
+        """Returns (key, input_series) for computing the last step elsewhere (e.g. in a process
+        pool) and storing it with put_result(key, series). Returns None if there's nothing to
+        compute, because the result is cached already or pushed down.
+        """
+        if not steps:
+            return None
+        if pushdown is not None and (pushed_series := pushdown(steps[0])) is not None:
+            pushed_uid = f"{source_uid}:{json.dumps(steps[0], sort_keys=True)}"
+            return self.get_pending(pushed_uid, pushed_series, steps[1:], recorder=recorder)
+        key = self._get_key(source_uid, source_series, steps)
+        if key in self.cache:
+            return None
+        return key, self.get_series(source_uid, source_series, steps[:-1], recorder=recorder)
+
+    def put_result(self, key: tuple, series: pd.Series) -> None:
+        self.cache.put(key, "derived", series)
+
+    @staticmethod
+    def _get_key(source_uid: str, source_series: pd.Series, steps: list) -> tuple:
+        return ("derived", source_uid, get_series_fingerprint(source_series), json.dumps(steps, sort_keys=True))
+
+    def _apply(self, source_uid: str, source_series: pd.Series, steps: list, 
+               recorder: RunRecorder = None) -> pd.Series:
+        # the previous steps are recorded by themselves (if not cached), not nested in this one
+        input_series = self.get_series(source_uid, source_series, steps[:-1], recorder=recorder)
+        transformer = self.interface.get_transformer(steps[-1]["transformer"])
+        if recorder is None:
+            return transformer(input_series=input_series, **steps[-1]["params"])
+        with recorder.stage("transformers") as timing:
+            series = transformer(input_series=input_series, **steps[-1]["params"])
+            timing.add_result(series)
+        return series
+
+
+if __name__ == "__main__":
+    import numpy as np
+    index = pd.date_range("2024-01-01", periods=10_000, freq="1h", tz="UTC")
+    source = pd.Series(np.arange(10_000.), index=index, name="meter")
+    evaluator = PipelineEvaluator(QueryCache(), SignalTransformersInterface())
+    steps = [make_step("diff", {}),
+             make_step("resample", {"interval_hours": 24, "aggregate_sum": True, "fill_na": False}),
+             make_step("cumsum", {})]
+    recorder = RunRecorder()
+    print(evaluator.get_series("uid", source, steps, recorder=recorder).tail(3))
+    print(evaluator.get_series("uid", source, steps[:2], recorder=recorder).name)
+    print(evaluator.cache.get_stats())
+    assert recorder.stages["transformers"].calls == 3  # cached steps aren't recorded
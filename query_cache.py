@@ -0,0 +1,146 @@
+"""Module providing a size limited LRU cache with per-kind time-to-live for query results
+"""
+
+import sys
+import time
+import threading
+import pandas as pd
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable
+
+# time-to-live in seconds per kind of cached result
+DEFAULT_TTLS = {"metadata": 3600.,   # databases, series, ...: change rarely
+                "data": 24 * 3600.,  # data windows in the past: don't change
+                "recent": 60.,       # data windows reaching up to now: new points arrive
+                "derived": 3600.}    # series evaluated from transformer steps
+
+RECENT_SECONDS = 3600  # data windows with a stop time after now - RECENT_SECONDS are "recent"
+
+
+def estimate_bytes(obj) -> int:
+    """Returns a cheap estimation of the memory used by obj
+    """
+    if isinstance(obj, (pd.Series, pd.DataFrame)):
+        return int(np.sum(obj.memory_usage(index=True, deep=False)))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(getattr(obj, "nbytes", None), int):  # e.g. interval_store.SegmentedSeries
+        return obj.nbytes
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(estimate_bytes(item) for item in obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_bytes(k) + estimate_bytes(v) for k, v in obj.items())
+    return sys.getsizeof(obj)
+
+
+def get_data_kind(stop: pd.Timestamp) -> str:
+    """Returns the cache kind for a data window ending at stop (naive timestamps are UTC)
+    """
+    stop = pd.Timestamp(stop)
+    if stop.tzinfo is None:
+        stop = stop.tz_localize("UTC")
+    if stop > pd.Timestamp.now(tz="UTC") - pd.Timedelta(seconds=RECENT_SECONDS):
+        return "recent"
+    return "data"
+
+
+@dataclass
+class CacheEntry:
+    value: object
+    kind: str
+    nbytes: int
+    expires: float
+
+
+class QueryCache():
+    """Thread-safe LRU cache limited by max_bytes, with a time-to-live per kind of entry.
+
+    Keys are tuples (e.g. ("data", database, query_plan)) so that all entries starting with
+    a given prefix can be invalidated at once.
+    """
+    def __init__(self, max_bytes: int = 256 * 2**20, ttls: dict = None) -> None:
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls is not None:
+            self.ttls.update(ttls)
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, key: tuple, kind: str, loader: Callable):
+        """Returns the cached value for key, or calls the loader and caches its return value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return entry.value
+                self._pop(key)
+                self._counters["expirations"] += 1
+            self._counters["misses"] += 1
+
+        value = loader()  # outside the lock, other sessions shouldn't wait for this query
+        self.put(key, kind, value)
+        return value
+
+    def __contains__(self, key: tuple) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.expires > time.monotonic()
+
+    def put(self, key: tuple, kind: str, value) -> None:
+        nbytes = estimate_bytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            if nbytes > self.max_bytes:
+                return  # would evict everything else and still not fit
+            self._entries[key] = CacheEntry(value=value, kind=kind, nbytes=nbytes,
+                                            expires=time.monotonic() + self.ttls[kind])
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._pop(oldest_key)
+                self._counters["evictions"] += 1
+
+    def invalidate(self, prefix: tuple = ()) -> int:
+        """Removes all entries whose key starts with prefix (all entries by default).
+        Returns the number of removed entries.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if key[:len(prefix)] == prefix]
+            for key in keys:
+                self._pop(key)
+            self._counters["invalidations"] += len(keys)
+            return len(keys)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._nbytes
+            stats["max_bytes"] = self.max_bytes
+            for kind in self.ttls:
+                stats[f"entries_{kind}"] = sum(1 for e in self._entries.values() if e.kind == kind)
+            return stats
+
+    def _pop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self._nbytes -= entry.nbytes
+
+
+if __name__ == "__main__":
+    cache = QueryCache(max_bytes=2**20, ttls={"recent": 0.1})
+    for i in range(20):
+        cache.get(("data", "db", i % 10), "data", lambda: np.zeros(2**14))  # 128 kB each
+    print(cache.get_stats())
+    cache.get(("data", "db", "now"), "recent", lambda: 1)
+    time.sleep(0.2)
+    cache.get(("data", "db", "now"), "recent", lambda: 1)
+    print(f"{cache.invalidate(('data',))=}")
+    print(cache.get_stats())
@@ -0,0 +1,141 @@
+"""Module planning InfluxDB data queries: long intervals are downsampled by the database
+using GROUP BY time() aggregates, short intervals are queried raw
+"""
+
+import datetime as dt
+from dataclasses import dataclass, asdict, fields, replace
+
+RFC3339_FORMAT = '%Y-%m-%dT%H:%M:%S.00000000Z'
+
+# "auto" picks "raw" or "mean" depending on the interval length and the point budget
+AGGREGATIONS = ("auto", "raw", "mean", "min", "max", "last")
+
+# "nice" GROUP BY time() bucket sizes in seconds, ascending
+BUCKET_SECONDS = (1, 5, 10, 30, 60, 120, 300, 600, 900, 1800, 3600, 2*3600, 3*3600, 6*3600, 12*3600,
+                  86400, 7*86400)
+
+# InfluxQL duration units, largest first
+DURATION_UNITS = (("w", 7*86400), ("d", 86400), ("h", 3600), ("m", 60), ("s", 1))
+
+
+def format_duration(seconds: int) -> str:
+    """Returns an InfluxQL duration literal like '1h' or '15m' for the given seconds
+    """
+    for unit, unit_seconds in DURATION_UNITS:
+        if seconds % unit_seconds == 0:
+            return f"{seconds // unit_seconds}{unit}"
+    raise ValueError(f"Invalid duration {seconds=}")
+
+
+@dataclass(frozen=True)
+class QueryPlan:
+    measurement: str
+    entity_id: str
+    start: dt.datetime
+    stop: dt.datetime
+    aggregation: str = "raw"  # or an InfluxQL function, aggregating GROUP BY time(bucket_seconds) if > 0
+    bucket_seconds: int = 0
+
+    def is_raw(self) -> bool:
+        return self.aggregation == "raw"
+
+    def get_suffix(self) -> str:
+        """Returns a series name suffix like '.mean1h' ('' for raw queries)
+        """
+        if self.is_raw():
+            return ""
+        if not self.bucket_seconds:
+            return f".{self.aggregation}"
+        return f".{self.aggregation}{format_duration(self.bucket_seconds)}"
+
+    def to_dict(self) -> dict:
+        """Returns the plan as JSON serializable dict (e.g. for a Trace.source)
+        """
+        plan = asdict(self)
+        plan["start"], plan["stop"] = self.start.isoformat(), self.stop.isoformat()
+        return plan
+
+    @classmethod
+    def from_dict(cls, plan: dict) -> "QueryPlan":
+        plan = {f.name: plan[f.name] for f in fields(cls)}
+        plan["start"], plan["stop"] = (dt.datetime.fromisoformat(plan[key]) for key in ("start", "stop"))
+        return cls(**plan)
+
+    def get_query_string(self) -> str:
+        """Returns the InfluxQL query string
+        """
+        start_string = self.start.strftime(RFC3339_FORMAT)
+        stop_string = self.stop.strftime(RFC3339_FORMAT)
+        if self.is_raw():
+            fields = "value, mean_value"
+        else:
+            fields = f"{self.aggregation}(value) AS value, {self.aggregation}(mean_value) AS mean_value"
+        qstr = f"""SELECT {fields} FROM "{self.measurement}" WHERE entity_id = '{self.entity_id}'
+                AND time >= '{start_string}'
+                AND time < '{stop_string}'"""
+        if self.bucket_seconds:  # else a non-aggregating function like difference
+            qstr += f"""
+                GROUP BY time({format_duration(self.bucket_seconds)}) fill(none)"""
+        return qstr
+
+
+class QueryPlanner():
+    """Plans data queries such that no more than roughly max_points are returned.
+
+    Intervals shorter than max_points * min_bucket_seconds are queried raw,
+    because the sensor data is rarely sampled faster than that anyway.
+    """
+    def __init__(self, max_points: int = 5000, min_bucket_seconds: int = 60) -> None:
+        self.max_points = max_points
+        self.min_bucket_seconds = min_bucket_seconds
+
+    def get_bucket_seconds(self, start: dt.datetime, stop: dt.datetime) -> int:
+        """Returns the smallest nice bucket size keeping the interval within max_points
+        """
+        interval_seconds = (stop - start).total_seconds()
+        for seconds in BUCKET_SECONDS:
+            if interval_seconds / seconds <= self.max_points:
+                return seconds
+        return int(-(-interval_seconds // (self.max_points * 86400)) * 86400)  # whole days
+
+    def plan(self, measurement: str, entity_id: str, start: dt.datetime, stop: dt.datetime,
+             aggregation: str = "auto") -> QueryPlan:
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Unknown {aggregation=}, expected one of {AGGREGATIONS}")
+
+        bucket_seconds = self.get_bucket_seconds(start, stop)
+        if aggregation == "auto":
+            aggregation = "raw" if bucket_seconds < self.min_bucket_seconds else "mean"
+
+        if aggregation == "raw":
+            bucket_seconds = 0
+        else:
+            bucket_seconds = max(bucket_seconds, self.min_bucket_seconds)
+
+        return QueryPlan(measurement=measurement, entity_id=entity_id, start=start, stop=stop,
+                         aggregation=aggregation, bucket_seconds=bucket_seconds)
+
+    def plan_detail(self, source: QueryPlan, start: dt.datetime, stop: dt.datetime) -> QueryPlan:
+        """Returns the plan of a part (e.g. a zoomed plot range) of the source plan, with the
+        aggregation of the source (raw stays raw) and a resolution not lower than the source one
+        """
+        if not source.bucket_seconds:  # raw or a non-aggregating function
+            return replace(source, start=start, stop=stop)
+        plan = self.plan(source.measurement, source.entity_id, start, stop, source.aggregation)
+        return replace(plan, bucket_seconds=min(plan.bucket_seconds, source.bucket_seconds))
+
+
+if __name__ == "__main__":
+    planner = QueryPlanner()
+    stop = dt.datetime.combine(dt.date.today(), dt.time(0))
+    for days in (1, 7, 30, 365):
+        plan = planner.plan("kWh", "sma_battery_charge_total", stop - dt.timedelta(days=days), stop)
+        print(f"{days=}, {plan.aggregation=}, {plan.bucket_seconds=}")
+        print(plan.get_query_string())
+
+    source = planner.plan("kWh", "sma_battery_charge_total", stop - dt.timedelta(days=365), stop, "max")
+    for hours in (1, 24 * 30, 24 * 365):
+        detail = planner.plan_detail(source, stop - dt.timedelta(hours=hours), stop)
+        assert detail.aggregation == "max" and detail.bucket_seconds <= source.bucket_seconds
+    raw_source = planner.plan("kWh", "sma_battery_charge_total", stop - dt.timedelta(days=365), stop, "raw")
+    assert planner.plan_detail(raw_source, stop - dt.timedelta(days=1), stop).is_raw()
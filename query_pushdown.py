@@ -0,0 +1,137 @@
+"""Module translating SignalTransformers steps into InfluxQL, such that the database computes them
+
+Only transformer steps applied to raw data of a query with known semantics are translated:
+    diff                        -> DIFFERENCE()
+    cumsum                      -> CUMULATIVE_SUM()
+    resample(interval_hours)    -> MEAN() or SUM() with GROUP BY time(), for intervals that
+                                   divide a day, because pandas aligns the buckets to the
+                                   first midnight and InfluxDB to the epoch
+Everything else returns None and is left to the pandas implementation.
+"""
+
+import dataclasses
+import numpy as np
+import pandas as pd
+from typing import Optional
+from query_planner import QueryPlan
+from SignalTransformer import SignalTransformersInterface
+
+
+@dataclasses.dataclass(frozen=True)
+class PushdownQuery:
+    plan: QueryPlan  # the query of the transformed data
+    transformer: str
+    params: tuple  # sorted (name, value) items of the transformer parameters
+
+    def get_query_string(self) -> str:
+        return self.plan.get_query_string()
+
+    def postprocess(self, series: pd.Series, input_series: pd.Series,
+                    interface: SignalTransformersInterface) -> pd.Series:
+        """Turns the database result into exactly what the pandas transformer returns for
+        input_series, the untransformed data of the same query
+        """
+        params = dict(self.params)
+        empty = pd.Series(dtype=float, name=input_series.name, index=pd.DatetimeIndex([], tz="UTC"))
+        name = interface.get_transformer(self.transformer)(input_series=empty, **params).name
+
+        if self.transformer == "diff" and len(input_series):
+            # pandas keeps the first timestamp with NaN, DIFFERENCE() drops it
+            first = pd.Series([np.nan], index=input_series.index[:1])
+            series = pd.concat([first, series.astype(np.float64)])
+        elif self.transformer == "resample" and len(series):
+            # pandas returns all buckets between the first and last, fill(none) only non-empty ones
+            full_index = pd.date_range(series.index[0], series.index[-1], name=series.index.name,
+                                       freq=pd.Timedelta(hours=params["interval_hours"]))
+            if params["aggregate_sum"]:
+                series = series.reindex(full_index, fill_value=0)
+            else:
+                series = series.reindex(full_index)
+                if params["fill_na"]:
+                    series = series.ffill()
+        series.name = name
+        return series
+
+    def matches(self, series: pd.Series, input_series: pd.Series, interface: SignalTransformersInterface,
+                check_points: int = 1000) -> bool:
+        """Returns True if the postprocessed result series fits input_series: the same index (diff,
+        cumsum) or buckets (resample), and the values of the pandas transformer for the first and
+        last points. It doesn't, if the database holds other data than input_series was loaded
+        from (e.g. points dropped by a retention policy).
+        """
+        if not len(input_series):
+            return not len(series)
+        params = dict(self.params)
+        transformer = interface.get_transformer(self.transformer)
+
+        def equal(result: pd.Series, expected: pd.Series) -> bool:
+            return np.allclose(result.to_numpy(dtype=np.float64), expected.to_numpy(dtype=np.float64),
+                               rtol=1e-6, atol=1e-9, equal_nan=True)
+
+        if self.transformer == "resample":
+            interval = pd.Timedelta(hours=params["interval_hours"])
+            first, last = input_series.index[0].floor(interval), input_series.index[-1].floor(interval)
+            if not series.index.equals(pd.date_range(first, last, freq=interval)):
+                return False
+            # the complete buckets of the first check_points and the last bucket
+            head_stop = input_series.index[min(check_points, len(input_series)) - 1].floor(interval)
+            head = input_series.iloc[:input_series.index.searchsorted(head_stop)]
+            tail = input_series.iloc[input_series.index.searchsorted(last):]
+            expected_head = transformer(input_series=head, **params) if len(head) else head
+            return (equal(series.iloc[:len(expected_head)], expected_head) and
+                    equal(series.iloc[-1:], transformer(input_series=tail, **params).iloc[-1:]))
+
+        if not series.index.equals(input_series.index):
+            return False
+        expected_head = transformer(input_series=input_series.iloc[:check_points], **params)
+        if self.transformer == "diff":
+            expected_tail = transformer(input_series=input_series.iloc[-check_points:], **params).iloc[1:]
+        else:  # cumsum, its last value
+            expected_tail = pd.Series([input_series.sum() if pd.notna(input_series.iat[-1]) else np.nan])
+        return (equal(series.iloc[:len(expected_head)], expected_head) and
+                equal(series.iloc[len(series) - len(expected_tail):], expected_tail))
+
+
+def translate(plan: QueryPlan, step: dict, last: pd.Timestamp = None) -> Optional[PushdownQuery]:
+    """Returns the PushdownQuery of the transformer step applied to the data of plan, or None
+    if the step can't be computed by the database with the same result
+
+    last is the time of the last point of the series loaded by plan. The pushed query stops
+    right after it, such that points written after the series was loaded are left out (plans
+    stop at full seconds, so this relies on less than one point per second).
+    """
+    if not plan.is_raw():
+        return None
+    if last is not None:
+        last = pd.Timestamp(last)
+        if last.tzinfo is not None:  # plans hold naive UTC datetimes
+            last = last.tz_convert("UTC").tz_localize(None)
+        stop = (last.floor("s") + pd.Timedelta(seconds=1)).to_pydatetime()
+        plan = dataclasses.replace(plan, stop=min(plan.stop, stop))
+    transformer, params = step["transformer"], step["params"]
+
+    if transformer == "diff":
+        pushed_plan = dataclasses.replace(plan, aggregation="difference", bucket_seconds=0)
+    elif transformer == "cumsum":
+        pushed_plan = dataclasses.replace(plan, aggregation="cumulative_sum", bucket_seconds=0)
+    elif transformer == "resample":
+        hours = params.get("interval_hours")
+        if not isinstance(hours, int) or hours <= 0 or 24 % hours:
+            return None
+        aggregation = "sum" if params.get("aggregate_sum") else "mean"
+        pushed_plan = dataclasses.replace(plan, aggregation=aggregation, bucket_seconds=hours * 3600)
+    else:
+        return None
+    return PushdownQuery(plan=pushed_plan, transformer=transformer, params=tuple(sorted(params.items())))
+
+
+if __name__ == "__main__":
+    import datetime as dt
+    from pipeline import make_step
+
+    plan = QueryPlan("kWh", "meter", dt.datetime(2024, 1, 1), dt.datetime(2024, 6, 1))
+    last = pd.Timestamp("2024-05-31 12:00:00.5", tz="UTC")
+    for step in (make_step("diff", {}), make_step("resample", {"interval_hours": 6, "aggregate_sum": True}),
+                 make_step("resample", {"interval_hours": 5, "aggregate_sum": True})):
+        pushdown = translate(plan, step, last)
+        print(step, "->", pushdown.get_query_string() if pushdown else "not translated, pandas fallback")
@@ -0,0 +1,24 @@
+"""Starts the streamlit server with the app and pre-warms it in the background (see startup.py),
+such that the first page load after a (container) restart doesn't import and connect everything
+
+    python serve.py --server.port=8501 --server.address=0.0.0.0
+
+The arguments are passed on to 'streamlit run streamlit_app.py'.
+"""
+
+import os
+import sys
+import startup
+
+
+if __name__ == "__main__":
+    # streamlit first: its import checks for a (maybe partially) imported pandas in sys.modules
+    from streamlit.web import cli
+    try:
+        startup.start_prewarm(startup.load_config("secrets.yaml"))
+    except OSError as e:  # e.g. no secrets.yaml, the app reports it on the first run
+        print(f"Pre-warming not started: {e!r}")
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+    sys.argv = ["streamlit", "run", app_path, *sys.argv[1:]]
+    sys.exit(cli.main())
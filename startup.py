@@ -0,0 +1,176 @@
+"""Module for a fast cold start of the app: the config is parsed once per process, heavy imports
+are deferred (and timed), and the InfluxDB pool and entity catalog are pre-warmed in the background
+
+The module itself only imports the standard library, so serve.py can start the pre-warming
+before the streamlit server. The pool (see influx_pool.get_pool) and the catalog store (see
+entity_catalog.get_catalog_store) are process-wide, so the first script run finds them warm.
+Startup timings are relative to the import of this module (near the process start with serve.py).
+"""
+
+import os
+import sys
+import time
+import importlib
+import threading
+
+POOL_SIZE = 8  # MULTI_QUERY_WORKERS of the app + 2
+# imported and exercised by the pre-warming, the app needs all of them for its first page
+PREWARM_IMPORTS = ("numpy", "pandas", "influxdb", "plotly.graph_objects", "streamlit_app")
+
+_t0 = time.perf_counter()
+_lock = threading.Lock()
+_configs = dict()  # path: config
+_imports = dict()  # module name: seconds of its first import
+_events = dict()  # name: seconds since the import of this module
+_durations = dict()  # name: seconds
+_errors = list()
+_prewarm_thread = None
+
+
+def timed_import(name: str):
+    """Imports module name and records the time of its first import in this process
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    t0 = time.perf_counter()
+    module = importlib.import_module(name)
+    with _lock:
+        _imports.setdefault(name, round(time.perf_counter() - t0, 4))
+    return module
+
+
+class LazyModule():
+    """Module placeholder importing the module on first attribute access, e.g.
+    go = LazyModule("plotly.graph_objects")
+    """
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute: str):
+        if self._module is None:
+            self._module = timed_import(self._name)
+        return getattr(self._module, attribute)
+
+
+def mark(event: str) -> None:
+    """Records the first time of event (e.g. 'first run') since the import of this module
+    """
+    with _lock:
+        _events.setdefault(event, round(time.perf_counter() - _t0, 4))
+
+
+def record(name: str, seconds: float) -> None:
+    """Records the duration of a startup step, only the first one of each name
+    """
+    with _lock:
+        _durations.setdefault(name, round(seconds, 4))
+
+
+def load_config(path: str = "secrets.yaml") -> dict:
+    """Returns the parsed config file, parsed only once per process
+    """
+    path = os.path.abspath(path)
+    with _lock:
+        if path in _configs:
+            return _configs[path]
+    t0 = time.perf_counter()
+    YAML = timed_import("ruamel.yaml").YAML
+    with open(path, "r") as file:
+        config = YAML().load(file)
+    record("config", time.perf_counter() - t0)
+    with _lock:
+        return _configs.setdefault(path, config)
+
+
+def get_influx_pool(config: dict):
+    """Returns the process-wide pool of InfluxDB clients of the config
+    """
+    get_pool = timed_import("influx_pool").get_pool
+    return get_pool(host=config["influx"]["host"], port=config["influx"]["port"],
+                    username=config["influx"]["username"], password=config["influx"]["password"],
+                    size=POOL_SIZE)
+
+
+def get_catalog(config: dict, database: str):
+    """Returns the entity catalog of database, loaded once and refreshed in the background
+    """
+    entity_catalog = timed_import("entity_catalog")
+    pool = get_influx_pool(config)
+
+    def load():
+        with pool.client(database) as client:
+            return entity_catalog.load_catalog(client)
+    return entity_catalog.get_catalog_store().get((config["influx"]["host"], config["influx"]["port"], database),
+                                                  load)
+
+
+def prewarm(config: dict) -> None:
+    """Imports the heavy modules, builds a figure (plotly loads its validators lazily),
+    connects to InfluxDB and loads the catalog of the default database (the first one, like
+    the apps database selectbox)
+    """
+    t0 = time.perf_counter()
+    try:
+        for name in PREWARM_IMPORTS:
+            timed_import(name)
+        t1 = time.perf_counter()
+        go = timed_import("plotly.graph_objects")
+        go.Figure(data=[go.Scatter(x=[0, 1], y=[0, 1]), go.Scattergl(x=[0, 1], y=[0, 1])]).to_json()
+        record("first figure", time.perf_counter() - t1)
+
+        t1 = time.perf_counter()
+        with get_influx_pool(config).client() as client:
+            databases = sorted([item["name"] for item in client.get_list_database()], reverse=True)
+        record("InfluxDB connection", time.perf_counter() - t1)
+        if databases:
+            t1 = time.perf_counter()
+            get_catalog(config, databases[0])
+            record("entity catalog", time.perf_counter() - t1)
+    except Exception as e:  # the app loads everything on demand then
+        print(f"Pre-warming failed: {e!r}")
+        with _lock:
+            _errors.append(repr(e))
+    record("pre-warming", time.perf_counter() - t0)
+    mark("pre-warmed")
+    print(f"Pre-warmed in {time.perf_counter() - t0:.2f}s: {get_stats()}")
+
+
+def start_prewarm(config: dict) -> threading.Thread:
+    """Starts the pre-warming in a background thread, once per process
+    """
+    global _prewarm_thread
+    with _lock:
+        if _prewarm_thread is None:
+            _prewarm_thread = threading.Thread(target=prewarm, args=(config,), name="prewarm", daemon=True)
+            _prewarm_thread.start()
+        return _prewarm_thread
+
+
+def wait_for_prewarm(timeout: float = 30.) -> None:
+    """Waits for a running pre-warming, such that nothing is loaded twice
+    """
+    if _prewarm_thread is not None and _prewarm_thread is not threading.current_thread():
+        _prewarm_thread.join(timeout)
+
+
+def get_stats() -> dict:
+    with _lock:
+        return {"uptime_s": round(time.perf_counter() - _t0, 1), "events_s": dict(_events),
+                "durations_s": dict(_durations), "imports_s": dict(_imports), "errors": list(_errors)}
+
+
+if __name__ == "__main__":
+    import numpy as np
+    import pandas as pd
+    from fake_influxdb import FakeInfluxDB
+
+    index = pd.date_range("2024-01-01", periods=10, freq="1min", tz="UTC")
+    entities = {("kWh", f"sensor_{i}"): pd.Series(np.arange(10.), index=index) for i in range(5000)}
+    with FakeInfluxDB({"home": entities}, delay=0.01) as fake:
+        config = {"influx": {"host": "localhost", "port": fake.port, "username": "root", "password": "root"}}
+        start_prewarm(config).join()
+        t0 = time.perf_counter()
+        catalog = get_catalog(config, "home")
+        print(f"catalog of {len(catalog)} entities after pre-warming in {(time.perf_counter() - t0) * 1000:.1f}ms")
+        print(get_stats())
@@ -1,14 +1,33 @@
-import json, os
+import json, os, time, uuid
+imports_started = time.perf_counter()
 import pandas as pd
 import datetime as dt
 import streamlit as st
-import plotly.graph_objects as go
-from copy import deepcopy
-from json_encoder_decoder import JsonEnc, JsonDec
-from dataclasses import dataclass, field, asdict
-from ruamel.yaml import YAML
-from influxdb import InfluxDBClient
+from io import StringIO
+from json_encoder_decoder import JsonEnc, JsonEncFast, JsonDec, JsonTracesWriter, iter_json_traces
+from dataclasses import dataclass, field, fields, replace
 from SignalTransformer import SignalTransformersInterface
+from pipeline import PipelineEvaluator, make_step, get_series_fingerprint
+from query_planner import QueryPlanner, QueryPlan, AGGREGATIONS
+from query_pushdown import translate
+from influx_loader import query_series
+from query_cache import QueryCache, get_data_kind
+from interval_store import IntervalStore
+from multi_query import query_concurrently
+from trace_file import dumps_traces, loads_traces, is_traces_file
+from decimation import decimate
+from interval_store import to_utc
+from typing import Callable, Iterator, Literal, get_args, get_origin
+from batch_transform import BatchResult, transform_batch, create_process_pool
+from aligned_frame import transform_aligned
+from calendar_resample import get_stats as get_calendar_resample_stats
+from entity_catalog import get_catalog_store
+from trace_store import TraceStore, TraceStoreSession
+from instrumentation import RunRecorder, Metrics, ProfileCapture
+from startup import LazyModule, load_config, get_influx_pool, get_catalog, wait_for_prewarm, mark, record
+from startup import get_stats as get_startup_stats
+
+go = LazyModule("plotly.graph_objects")  # needed only once there are traces
     
     
 @dataclass
@@ -16,19 +35,67 @@ class Trace:
     entity: str
     unit: str
     line_mode: str = "lines"
-    series: pd.Series = field(default_factory=pd.Series, compare=False, hash=False, repr=False)
+    series: pd.Series = field(default_factory=pd.Series, compare=False, hash=False, repr=False)  # None if stored
+    decimate: bool = True  # reduce to the plotting budget of points
+    source: dict = None  # host, port, database and QueryPlan.to_dict() of traces queried and not transformed
+    uid: str = field(default_factory=lambda: uuid.uuid4().hex)
+    base: str = None  # uid of the source trace, if this trace is derived by transformer steps
+    steps: list = field(default_factory=list)  # transformer steps applied to the source trace
+    name: str = None  # name of traces which don't hold their series (derived or stored)
+    stored: str = None  # key of the series in the trace store, see trace_store.py
+    
+    def is_derived(self) -> bool:
+        return self.base is not None
+    
+    def holds_series(self) -> bool:
+        return not self.is_derived() and self.stored is None
+        
+    def get_name(self) -> str:
+        return self.series.name if self.holds_series() else self.name
         
     def get_label(self) -> str:
         """Returns a trace label like 'garden temperature (°C)'
         """
-        return f"{self.series.name} ({self.unit})"
+        return f"{self.get_name()} ({self.unit})"
+
+
+WEBGL_THRESHOLD = 5000  # points per trace
+
+
+class FigureCache():
+    """Scatter plots and figures of the previous run by the fingerprint of their content, kept
+    in the session_state as one object, its tuple keys aren't JSON serializable (e.g. for the
+    session state display)
+    """
+    def __init__(self) -> None:
+        self.scatters = dict()
+        self.figures = dict()
+        self.stats = {"hits": 0, "misses": 0}
+    
+    def __repr__(self) -> str:
+        return f"FigureCache({len(self.scatters)} scatters, {len(self.figures)} figures, {self.stats})"
 
 
 class TracesHandler():
+    # pushdown_loader(database, pushdown_query, input_series) returns transformed series 
+    # computed by the database, see query_pushdown.py. None disables the pushdown.
+    pushdown_loader = None
+    # (host, port) and databases of the connected InfluxDB, only traces queried from there are
+    # queried again (pushdown, details)
+    server = None
+    databases = ()
+    # stages of the current run, see instrumentation.py. The script and so this class are
+    # executed anew on each run.
+    recorder = RunRecorder()
+    
     def __init__(self) -> None:
-        # store the actual traces in the session_state
+        # store the actual traces in the session_state, their series in the trace store
         if "traces" not in st.session_state:
             st.session_state["traces"] = list()
+        if "trace_store" not in st.session_state:
+            st.session_state["trace_store"] = get_trace_store().open_session()
+        # release the series of traces deleted by the previous run
+        st.session_state.trace_store.set_keys({trace.stored for trace in st.session_state.traces if trace.stored})
     
     @staticmethod
     def get_traces_names() -> list:
@@ -39,49 +106,343 @@ class TracesHandler():
         
     @staticmethod
     def add_trace(trace: Trace) -> None:
-        st.session_state.traces.append(trace)
+        """Adds trace, its series is moved to the trace store (shared with other sessions)
+        """
+        st.session_state.traces.append(TracesHandler.store_series(trace))
     
     @staticmethod
-    def get_traces_figures() -> list:
+    def store_series(trace: Trace) -> Trace:
+        """Moves the series of trace to the trace store, if it can be stored there (e.g. not
+        strings), and returns trace
+        """
+        if trace.holds_series() and TraceStore.can_store(trace.series):
+            trace.stored = st.session_state.trace_store.put(trace.series)
+            trace.name, trace.series = trace.series.name, None
+        return trace
+    
+    @staticmethod
+    def get_trace_by_uid(uid: str, traces: list = None) -> Trace:
+        for trace in st.session_state.traces if traces is None else traces:
+            if trace.uid == uid:
+                return trace
+        raise KeyError(f"No trace with {uid=}")
+    
+    @staticmethod
+    def get_series(trace: Trace, traces: list = None, trace_store: TraceStoreSession = None) -> pd.Series:
+        """Returns the traces series, derived traces are evaluated from their source trace. 
+        The traces and trace_store of the session state are used, unless given (e.g. on threads
+        without the session state).
+        """
+        if trace.holds_series():
+            return trace.series
+        if not trace.is_derived():
+            trace_store = st.session_state.trace_store if trace_store is None else trace_store
+            series = trace_store.get(trace.stored).copy(deep=False)
+            series.name = trace.name
+            return series
+        source = TracesHandler.get_trace_by_uid(trace.base, traces)
+        source_series = TracesHandler.get_series(source, traces, trace_store)
+        return get_pipeline_evaluator().get_series(source.uid, source_series, trace.steps, 
+                                                   TracesHandler.get_pushdown(source, traces, trace_store),
+                                                   recorder=TracesHandler.recorder)
+    
+    @staticmethod
+    def is_queryable(trace: Trace) -> bool:
+        """Returns True if trace was queried from the connected InfluxDB
+        """
+        return (bool(trace.source) and "start" in trace.source and trace.source.get("database") in TracesHandler.databases
+                and (trace.source.get("host"), trace.source.get("port")) == TracesHandler.server)
+    
+    @staticmethod
+    def get_pushdown(source: Trace, traces: list = None, trace_store: TraceStoreSession = None) -> Callable:
+        """Returns the pushdown(step) callable for the PipelineEvaluator, if the source trace
+        is queried and the pushdown is enabled, else None (see get_series for traces and 
+        trace_store)
+        """
+        if TracesHandler.pushdown_loader is None or not TracesHandler.is_queryable(source):
+            return None
+        plan = QueryPlan.from_dict(source.source)
+        def pushdown(step: dict) -> pd.Series:
+            source_series = TracesHandler.get_series(source, traces, trace_store)
+            if not len(source_series):
+                return None
+            # the pushed query stops at the last point of the source series, newer points are left out
+            if (pushdown_query := translate(plan, step, source_series.index[-1])) is None:
+                return None
+            series = TracesHandler.pushdown_loader(source.source["database"], pushdown_query, source_series)
+            if not pushdown_query.matches(series, source_series, SignalTransformersInterface()):
+                return None  # the database holds other data than the source trace, e.g. after retention
+            return series
+        return pushdown
+    
+    @staticmethod
+    def apply_transformer_batch(traces: list, transformer_name: str, params: dict) -> Iterator[BatchResult]:
+        """Adds traces derived from traces by the transformer step. The new steps are computed 
+        as one aligned block where that's faster (see transform_aligned), else by transform_batch (in the process
+        pool for costly transformers of many points), and stored in the pipeline evaluator cache.
+        BatchResults (with the new traces uid as key) are yielded as they complete.
+        """
+        evaluator = get_pipeline_evaluator()
+        pending = dict()  # new trace uid: (new trace, evaluator key, input series)
+        for trace in traces:
+            new_trace = TracesHandler.add_derived_trace(trace, transformer_name, params, evaluate=False)
+            source = TracesHandler.get_trace_by_uid(new_trace.base)
+            if todo := evaluator.get_pending(source.uid, TracesHandler.get_series(source), new_trace.steps, 
+                                             TracesHandler.get_pushdown(source), recorder=TracesHandler.recorder):
+                pending[new_trace.uid] = (new_trace, *todo)
+            else:
+                new_trace.name = TracesHandler.get_series(new_trace).name
+                yield BatchResult(key=new_trace.uid, series=TracesHandler.get_series(new_trace))
+        
+        input_series = {uid: series for uid, (_, _, series) in pending.items()}
+        # only the computed steps are recorded, the cached ones and their inputs are not
+        with TracesHandler.recorder.stage("transformers") as timing:
+            t0 = time.perf_counter()
+            aligned = transform_aligned(list(input_series.values()), transformer_name, params)
+            if aligned is not None:
+                seconds = (time.perf_counter() - t0) / len(aligned)
+                results = (BatchResult(key=uid, series=series, seconds=seconds) 
+                           for uid, series in zip(input_series, aligned))
+            else:
+                results = transform_batch(get_process_pool(), input_series, transformer_name, params)
+            for result in results:
+                new_trace, key, _ = pending[result.key]
+                if result.ok():
+                    evaluator.put_result(key, result.series)
+                    new_trace.name = result.series.name
+                    timing.add_result(result.series)
+                else:
+                    st.session_state.traces.remove(new_trace)
+                yield result
+    
+    @staticmethod
+    def add_derived_trace(trace: Trace, transformer_name: str, params: dict, evaluate: bool = True) -> Trace:
+        """Adds a trace derived from trace by one more transformer step. It's evaluated only to
+        get its name, which is left empty with evaluate=False.
+        """
+        # copies of the steps, such that editing the params of one trace doesn't change the other
+        steps = [make_step(step["transformer"], step["params"]) for step in trace.steps] if trace.is_derived() else list()
+        new_trace = Trace(entity=trace.entity, unit=trace.unit, line_mode=trace.line_mode, 
+                          decimate=trace.decimate, base=trace.base if trace.is_derived() else trace.uid, 
+                          steps=steps + [make_step(transformer_name, params)])
+        if evaluate:
+            new_trace.name = TracesHandler.get_series(new_trace).name
+        TracesHandler.add_trace(new_trace)
+        return new_trace
+    
+    @staticmethod
+    def materialize(trace: Trace, traces: list = None, trace_store: TraceStoreSession = None) -> Trace:
+        """Returns a copy of trace with its series, evaluated if derived (e.g. for export, see
+        get_series for traces and trace_store)
+        """
+        if trace.holds_series():
+            return trace
+        series = TracesHandler.get_series(trace, traces, trace_store).copy(deep=False)
+        series.name = trace.name
+        return replace(trace, series=series, base=None, name=None, stored=None)
+    
+    @staticmethod
+    def get_time_range() -> tuple:
+        """Returns the (first, last) timestamp of all traces as naive UTC datetimes, or None.
+        Traces which fail to evaluate are left out (get_traces_figures reports them).
+        """
+        series_list = list()
+        for trace in st.session_state.traces:
+            try:
+                series = TracesHandler.get_series(trace)
+            except Exception:
+                continue
+            if len(series):
+                series_list.append(series)
+        if not series_list:
+            return None
+        first = min(to_utc(series.index[0]) for series in series_list)
+        last = max(to_utc(series.index[-1]) for series in series_list)
+        return first.tz_localize(None).to_pydatetime(), last.tz_localize(None).to_pydatetime()
+    
+    @staticmethod
+    def get_range_series(trace: Trace, x_range: tuple = None, detail_loader: Callable = None) -> pd.Series:
+        """Returns the traces series within the x_range (naive UTC datetimes). For traces 
+        queried from the connected InfluxDB, the detail_loader(trace, start, stop) is used to 
+        fetch a higher resolution of the x_range.
+        """
+        series = TracesHandler.get_series(trace)
+        if x_range is not None:
+            start, stop = (to_utc(x) for x in x_range)
+            if detail_loader is not None and TracesHandler.is_queryable(trace):
+                series = detail_loader(trace, *x_range)
+            if isinstance(series.index, pd.DatetimeIndex) and series.index.tz is None:
+                start, stop = start.tz_localize(None), stop.tz_localize(None)
+            series = series.iloc[series.index.searchsorted(start, "left"):series.index.searchsorted(stop, "right")]
+        return series
+    
+    @staticmethod
+    def get_traces_figures(max_points: int = 2000, x_range: tuple = None, 
+                           detail_loader: Callable = None) -> list:
         """Returns a list of plotly figures sorted by the traces unit
+        
+        Traces are reduced to max_points (if decimation is enabled) and drawn with WebGL if 
+        they still have more than WEBGL_THRESHOLD points.
+        
+        The scatter plots and figures are memoized in the session_state (see FigureCache) by 
+        the fingerprint of their content, so only figures with changed traces are rebuilt. 
+        Entries not used by the current call are dropped.
         """
+        cache = st.session_state.setdefault("figure_cache", FigureCache())
+        scatter_cache, figure_cache, stats = cache.scatters, cache.figures, cache.stats
+        new_scatter_cache, new_figure_cache = dict(), dict()
+        
         units = set()
         for trace in st.session_state.traces:
             units.add(trace.unit)
         
         figures = list()
         for unit in sorted(units):
-            fig = go.Figure()
+            scatter_keys = list()
             for idx, trace in enumerate(st.session_state.traces):
                 if trace.unit == unit:
                     name = f"{idx}. {trace.get_label()}"
-                    fig.add_trace(go.Scatter(x=trace.series.index, y=trace.series.values, 
-                                             mode=trace.line_mode, showlegend=True, name=name))
-            fig.update_layout(yaxis_title=unit)
+                    try:
+                        series = TracesHandler.get_range_series(trace, x_range, detail_loader)
+                    except Exception as e:  # e.g. a derived trace whose steps fail, the others are still plotted
+                        st.error(f"Exception {e} while evaluating trace {name}, it's not plotted")
+                        continue
+                    key = (name, trace.line_mode, trace.decimate and max_points, 
+                           get_series_fingerprint(series))
+                    if key in scatter_cache:
+                        new_scatter_cache[key] = scatter_cache[key]
+                    elif key not in new_scatter_cache:
+                        if trace.decimate:
+                            series = decimate(series, max_points)
+                        scatter = go.Scattergl if len(series) > WEBGL_THRESHOLD else go.Scatter
+                        new_scatter_cache[key] = scatter(x=series.index, y=series.values, 
+                                                         mode=trace.line_mode, showlegend=True, name=name)
+                    scatter_keys.append(key)
+            
+            figure_key = (unit, tuple(scatter_keys))
+            if figure_key in figure_cache:
+                stats["hits"] += 1
+                fig = figure_cache[figure_key]
+            else:
+                stats["misses"] += 1
+                fig = go.Figure(data=[new_scatter_cache[key] for key in scatter_keys])
+                fig.update_layout(yaxis_title=unit)
+            new_figure_cache[figure_key] = fig
             figures.append(fig)
+        
+        cache.scatters, cache.figures = new_scatter_cache, new_figure_cache
         return figures
             
     @staticmethod
     def del_trace(idx: int) -> None:
-        """Change the name of the trace with the index idx
+        """Delete the trace with the index idx, traces derived from it are materialized (into
+        the trace store)
         """
         try:
-            st.session_state.traces.pop(idx)
+            trace = st.session_state.traces[idx]
         except IndexError:
-            pass
+            return
+        traces = st.session_state.traces
+        for derived_idx, derived in enumerate(traces):
+            if derived.base == trace.uid:
+                traces[derived_idx] = TracesHandler.store_series(TracesHandler.materialize(derived))
+        traces.pop(idx)
     
     
     @staticmethod
-    def get_traces_as_json() -> str:
-        traces = [asdict(trace) for trace in st.session_state.traces]
-        obj = {"type": "Streamlit database browser traces file",
-               "version": 1,
-               "content": traces}
-        
-        return json.dumps(obj, cls=JsonEnc)    
+    def materialize_all(traces: list = None, trace_store: TraceStoreSession = None) -> list:
+        """Returns the materialized traces (see materialize), traces which fail to evaluate are
+        left out with an error message
+        """
+        traces = st.session_state.traces if traces is None else traces
+        materialized = list()
+        for idx, trace in enumerate(traces):
+            try:
+                materialized.append(TracesHandler.materialize(trace, traces, trace_store))
+            except Exception as e:
+                st.error(f"Exception {e} while evaluating trace {idx}. {trace.get_label()}, it's not exported")
+        return materialized
+    
+    @staticmethod
+    def get_traces_as_json(readable: bool = False, traces: list = None, trace_store: TraceStoreSession = None) -> str:
+        """Returns the traces as JSON, with base64 packed arrays unless readable
+        """
+        header = {"type": "Streamlit database browser traces file",
+                  "version": 1}
+        file = StringIO()
+        with JsonTracesWriter(file, header, cls=JsonEnc if readable else JsonEncFast) as writer:
+            for trace in TracesHandler.materialize_all(traces, trace_store):
+                writer.write({f.name: getattr(trace, f.name) for f in fields(trace)})
+        return file.getvalue()
+    
+    @staticmethod
+    def get_traces_as_binary(traces: list = None, trace_store: TraceStoreSession = None) -> bytes:
+        """Returns the traces in the compact binary traces file format (see trace_file.py)
+        """
+        return dumps_traces(TracesHandler.materialize_all(traces, trace_store))
+    
+    @staticmethod
+    def get_traces_exports(readable: bool = False) -> tuple:
+        """Returns callables building the binary and the JSON traces file, for the data of
+        download buttons. They are called only when the button is clicked, on a thread without
+        the session state, so the current traces and trace store are bound here.
+        """
+        traces, trace_store = list(st.session_state.traces), st.session_state.trace_store
+        return (lambda: TracesHandler.get_traces_as_binary(traces, trace_store), 
+                lambda: TracesHandler.get_traces_as_json(readable, traces, trace_store))
     
 
+@st.cache_resource
+def get_query_cache() -> QueryCache:
+    """Returns the query cache, shared by all sessions and reruns of this process
+    """
+    return QueryCache()
+
+
+@st.cache_resource
+def get_interval_store() -> IntervalStore:
+    """Returns the incremental data store, shared by all sessions and reruns of this process
+    """
+    return IntervalStore(get_query_cache())
+
+
+@st.cache_resource
+def get_process_pool():
+    """Returns the process pool for batch transformations, shared by all sessions
+    """
+    return create_process_pool()
+
+
+@st.cache_resource
+def get_pipeline_evaluator() -> PipelineEvaluator:
+    """Returns the evaluator of derived traces, its results are cached in the query cache
+    """
+    return PipelineEvaluator(get_query_cache(), SignalTransformersInterface())
+
+
+@st.cache_resource
+def get_trace_store() -> TraceStore:
+    """Returns the store of the traces series, shared by all sessions
+    """
+    return TraceStore()
+
+
+@st.cache_resource
+def get_metrics() -> Metrics:
+    """Returns the stage timings summed over all runs of all sessions
+    """
+    return Metrics()
+
+
 if __name__ == "__main__":
+    record("script imports", time.perf_counter() - imports_started)  # of the first run, imports are cached then
+    mark("first run")
+    
+    # the recorder is passed explicitly to closures running in worker threads
+    TracesHandler.recorder = recorder = RunRecorder()
+    if profiler := st.session_state.pop("profile_run", None):
+        profile_capture = ProfileCapture(profiler)
+        profile_capture.start()
     
     traces_handler = TracesHandler()
     transf_interface = SignalTransformersInterface()
@@ -89,52 +450,60 @@ if __name__ == "__main__":
     # streamlit app start
     st.header("Database explorer", divider="red")
 
-    with open("secrets.yaml", "r") as file:
-        secrets = YAML().load(file)
-        host = secrets["influx"]["host"]
-        port = secrets["influx"]["port"]
+    config = load_config("secrets.yaml")  # parsed once per process
+    host = config["influx"]["host"]
+    port = config["influx"]["port"]
 
+    MULTI_QUERY_WORKERS = 6
+    influx_pool = get_influx_pool(config)  # of startup.POOL_SIZE clients
+    
+    def load_series(query_database: str, plan) -> pd.Series:
+        """Runs the query of plan (a QueryPlan or PushdownQuery) with a pooled client, which is
+        held only for this query, such that concurrent runs don't exhaust the pool
+        """
+        with influx_pool.client(query_database) as query_client:
+            return query_series(query_client, plan.get_query_string(), recorder=recorder)
+    
+    def list_databases() -> list:
+        with influx_pool.client() as metadata_client:
+            return sorted([item["name"] for item in metadata_client.get_list_database()], reverse=True)
+    
     try:
         ############################################################################################
         st.subheader("Select a database", divider="blue")
         st.write(f"Connecting to InfluxDB at {host}, {port=}")
-        client = InfluxDBClient(host=host, port=port, 
-                                username=secrets["influx"]["username"], 
-                                password=secrets["influx"]["password"])
 
-        databases = sorted([item["name"] for item in client.get_list_database()], reverse=True)
+        query_cache = get_query_cache()
+        with recorder.stage("metadata query") as timing:
+            databases = query_cache.get(("databases", host, port), "metadata", list_databases)
+            timing.rows = len(databases)
+        TracesHandler.server, TracesHandler.databases = (host, port), tuple(databases)
 
         database = st.selectbox('database', databases)
 
-        client.switch_database(database)
-
-        # create dataframe of entities
-        records = list()
-        for point in ["unit=" + p["key"].replace("\\", "") for p in client.query("show series").get_points()]:
-            # point example: unit=kWh,domain=sensor,entity_id=sma_battery_charge_total
-            record = dict()
-            for item in point.split(","):
-                key, value = item.split("=")
-                record[key] = value
-            records.append(record)
-        entities = pd.DataFrame.from_records(records)
+        # catalog of the entities, loaded once per database (or pre-warmed, see serve.py) and 
+        # refreshed in the background
+        wait_for_prewarm()
+        with recorder.stage("metadata query") as timing:
+            catalog = get_catalog(config, database)
+            timing.rows = len(catalog)
 
         st.subheader(f"Available entities", divider="blue")
-        with st.expander(f"There are {len(entities)} entities available in {database}"):
-            st.dataframe(entities, height=200)
+        with st.expander(f"There are {len(catalog)} entities available in {database}"):
+            st.dataframe(catalog.to_frame(), height=200)
 
         ############################################################################################
         # Query entities
         st.subheader(f"Query entities", divider="blue")
-        unit_col, entity_col = st.columns([1, 2])
-
-        unit = unit_col.selectbox("unit", ["'all units'"] + list(entities["unit"].unique()))
-        if unit == "'all units'":
-            entity_ids = entities["entity_id"]
-        else:
-            entity_ids = entities[entities["unit"] == unit]["entity_id"]
+        unit_col, search_col, entity_col = st.columns([1, 1, 2])
 
-        entity_col.selectbox("entity_id", entity_ids, key="sel_entity_id")      
+        unit = unit_col.selectbox("unit", ["'all units'"] + catalog.get_units())
+        unit = None if unit == "'all units'" else unit
+        search = search_col.text_input("search entity_id", help="entity_ids starting with or containing the text")
+        entity_col.selectbox("entity_id", catalog.search(search, unit), key="sel_entity_id")      
+        if st.session_state["sel_entity_id"] is None:  # only the single entity query is skipped
+            st.warning(f"No entity_id matches '{search}'")
+        entity_ids = catalog.get_entity_ids(unit)
             
         if "start_date" not in st.session_state:
             st.session_state["start_date"] = dt.datetime.now().date() - dt.timedelta(days=365)
@@ -169,38 +538,92 @@ if __name__ == "__main__":
             cols[1].button("1 month", on_click=set_one_month, help="set start date one month before stop date")
             cols[2].button("1 week", on_click=set_one_week, help="set start date one week before stop date")
             cols[3].button("1 day", on_click=set_one_day, help="set start date one day before stop date")
+            cols = st.columns(2)
+            cols[0].selectbox("aggregation", AGGREGATIONS, key="aggregation",
+                              help="'auto' downsamples long intervals on the database, 'raw' returns every point")
+            cols[1].number_input("max points", min_value=100, step=1000, value=5000, key="max_points",
+                                 help="point budget for aggregated queries")
         
         # build query string
-        RFC3339_FORMAT = '%Y-%m-%dT%H:%M:%S.00000000Z'
-        start_string = dt.datetime.combine(st.session_state["start_date"], st.session_state["start_time"]).strftime(RFC3339_FORMAT)
-        stop_string = dt.datetime.combine(st.session_state["stop_date"], st.session_state["stop_time"]).strftime(RFC3339_FORMAT)
+        start = dt.datetime.combine(st.session_state["start_date"], st.session_state["start_time"])
+        stop = dt.datetime.combine(st.session_state["stop_date"], st.session_state["stop_time"])
         
-        selected_unit = next(iter(entities[entities["entity_id"] == st.session_state["sel_entity_id"]]["unit"]))
-        qstr = f"""SELECT value, mean_value FROM "{selected_unit}" WHERE entity_id = '{st.session_state["sel_entity_id"]}' 
-                AND time >= '{start_string}'
-                AND time < '{stop_string}'"""
-        st.code(qstr, language="sql")    
+        interval_store = get_interval_store()
+        if st.session_state["sel_entity_id"] is not None:
+            selected_unit = catalog.get_unit(st.session_state["sel_entity_id"])
+            query_plan = QueryPlanner(max_points=st.session_state["max_points"]).plan(
+                measurement=selected_unit, entity_id=st.session_state["sel_entity_id"], 
+                start=start, stop=stop, aggregation=st.session_state["aggregation"])
+            qstr = query_plan.get_query_string()
+            st.code(qstr, language="sql")    
         
-        # query the data
-        df = pd.DataFrame.from_records(client.query(qstr).get_points())
-        if len(df):
-            df.time = pd.to_datetime(df.time)
-            df = df.set_index("time")
-            df = df.dropna(axis=1)   # either value or mean_value column should be None
-            series = df[df.columns[0]]  # the df should have just one column at this point (value or mean_value)
-            series.name = st.session_state["sel_entity_id"]
-            if st.button("add to traces"):
-                trace = Trace(entity=st.session_state["sel_entity_id"],
-                              unit=selected_unit, series=series)
-                traces_handler.add_trace(trace)        
+            # query the data, only the parts of the interval which haven't been loaded before
+            segments_key = interval_store.get_key((host, port, database), query_plan)
+            if st.button("refresh", help="fetch new data of the selected entity"):
+                interval_store.refresh(segments_key)
+            series = interval_store.get_series(segments_key, query_plan, 
+                                               lambda plan: load_series(database, plan))
+            series = series.copy(deep=False)  # don't rename the cached series
+            series.name = st.session_state["sel_entity_id"] + query_plan.get_suffix()
+            if len(series):
+                if st.button("add to traces"):
+                    trace = Trace(entity=st.session_state["sel_entity_id"],
+                                  unit=selected_unit, series=series,
+                                  source={"host": host, "port": port, "database": database, 
+                                          **query_plan.to_dict()})
+                    traces_handler.add_trace(trace)        
             
-            ############################################################################################
-            # Preview data
-            with st.expander(f"Preview {len(series)} points of data"):
-                list_col, plot_col = st.columns(2)
-                list_col.dataframe(series.head(8))
-                plot_col.scatter_chart(series)
+                ############################################################################################
+                # Preview data
+                with st.expander(f"Preview {len(series)} points of data"):
+                    list_col, plot_col = st.columns(2)
+                    list_col.dataframe(series.head(8))
+                    plot_col.scatter_chart(series)
 
+        ############################################################################################
+        # Query multiple entities concurrently
+        with st.expander("Query multiple entities"):
+            st.multiselect("entity_ids", entity_ids, key="sel_entity_ids")
+            if st.button("add selected to traces", disabled=not st.session_state["sel_entity_ids"]):
+                planner = QueryPlanner(max_points=st.session_state["max_points"])
+                plans = [planner.plan(measurement=catalog.get_unit(entity_id), entity_id=entity_id, start=start, stop=stop,
+                                      aggregation=st.session_state["aggregation"])
+                         for entity_id in st.session_state["sel_entity_ids"]]
+                
+                def load_plan(plan):
+                    return interval_store.get_series(interval_store.get_key((host, port, database), plan), plan,
+                                                     lambda gap_plan: load_series(database, gap_plan))
+                
+                progress = st.progress(0.)
+                timings = list()
+                for n, result in enumerate(query_concurrently(plans, load_plan, MULTI_QUERY_WORKERS), start=1):
+                    entity_id = result.plan.entity_id
+                    progress.progress(n / len(plans), text=f"{n}/{len(plans)} queries done, last: {entity_id}")
+                    if result.ok() and len(result.series):
+                        result_series = result.series.copy(deep=False)
+                        result_series.name = entity_id + result.plan.get_suffix()
+                        traces_handler.add_trace(Trace(entity=entity_id, unit=result.plan.measurement, 
+                                                       series=result_series,
+                                                       source={"host": host, "port": port, "database": database, 
+                                                               **result.plan.to_dict()}))
+                    timings.append({"entity_id": entity_id, 
+                                    "points": len(result.series) if result.ok() else 0,
+                                    "seconds": round(result.seconds, 3), 
+                                    "error": "" if result.ok() else repr(result.error)})
+                st.dataframe(pd.DataFrame(timings), hide_index=True)
+                if failed := [timing["entity_id"] for timing in timings if timing["error"]]:
+                    st.warning(f"{len(failed)} of {len(plans)} queries failed: {', '.join(failed)}")
+
+        def load_pushdown(pushdown_database: str, pushdown_query, input_series: pd.Series) -> pd.Series:
+            def load():
+                series = load_series(pushdown_database, pushdown_query)
+                return pushdown_query.postprocess(series, input_series, transf_interface)
+            return query_cache.get(("pushdown", host, port, pushdown_database, pushdown_query), 
+                                   get_data_kind(pushdown_query.plan.stop), load)
+        
+        if st.session_state.get("pushdown", True):
+            TracesHandler.pushdown_loader = load_pushdown
+        
         ############################################################################################
         # Edit traces
         st.subheader("Edit traces", divider="blue")        
@@ -212,9 +635,12 @@ if __name__ == "__main__":
         if sel_trace_str is not None:
             sel_trace_idx = int(sel_trace_str.split(".")[0])
             sel_trace = st.session_state.traces[sel_trace_idx]
-            st.session_state.sel_trace_name = sel_trace.series.name
+            st.session_state.sel_trace_name = sel_trace.get_name()
             def edit_trace_name():
-                sel_trace.series.name = st.session_state.sel_trace_name
+                if sel_trace.holds_series():
+                    sel_trace.series.name = st.session_state.sel_trace_name
+                else:
+                    sel_trace.name = st.session_state.sel_trace_name
             
             ecol2.text_input("edit trace name", key="sel_trace_name", on_change=edit_trace_name)
             
@@ -227,6 +653,51 @@ if __name__ == "__main__":
                             index=line_modes[sel_trace.line_mode],
                             on_change=edit_line_mode)
             
+            st.session_state.decimate = sel_trace.decimate
+            def edit_decimate():
+                sel_trace.decimate = st.session_state.decimate
+            
+            ecol2.checkbox("decimate for plotting", key="decimate", on_change=edit_decimate,
+                           help="reduce the trace to the plot points budget, keeping its shape")
+            
+            def param_input(container, param_name: str, param_type: type, key: str, **kwargs) -> None:
+                """Places an input widget for a transformer parameter of param_type
+                """
+                if param_type == bool:
+                    container.checkbox(param_name, key=key, **kwargs)
+                elif param_type == int:
+                    container.number_input(param_name, step=1, key=key, **kwargs)
+                elif param_type == float:
+                    container.number_input(param_name, key=key, format="%g", **kwargs)
+                elif param_type == str:
+                    container.text_input(param_name, key=key, **kwargs)
+                elif get_origin(param_type) is Literal:  # a choice, e.g. the calendar period
+                    container.selectbox(param_name, get_args(param_type), key=key, **kwargs)
+            
+            ############################################################################################
+            # Re-parameterize the transformer steps of derived traces
+            if sel_trace.is_derived():
+                source_label = traces_handler.get_trace_by_uid(sel_trace.base).get_label()
+                with ecol2.expander(f"Transformer steps applied to {source_label}"):
+                    for step_idx, step in enumerate(sel_trace.steps):
+                        st.write(f"{step_idx + 1}. {step['transformer']}")
+                        for param_name, param_type, _ in transf_interface.get_transformer_parameters(step["transformer"]):
+                            step_key = f"step_{step_idx}_{param_name}"
+                            st.session_state[step_key] = step["params"][param_name]
+                            def edit_step_param(step_idx=step_idx, param_name=param_name, step_key=step_key):
+                                # the edited steps are evaluated as a copy, the trace changes only if they work
+                                steps = [make_step(step["transformer"], step["params"]) for step in sel_trace.steps]
+                                steps[step_idx]["params"][param_name] = st.session_state[step_key]
+                                try:
+                                    name = traces_handler.get_series(replace(sel_trace, steps=steps)).name
+                                except Exception as e:
+                                    st.session_state[step_key] = sel_trace.steps[step_idx]["params"][param_name]
+                                    st.error(f"Exception {e} while evaluating {param_name}={steps[step_idx]['params'][param_name]!r}, "
+                                             f"the parameter is not changed")
+                                    return
+                                sel_trace.steps, sel_trace.name = steps, name
+                            param_input(st, param_name, param_type, step_key, on_change=edit_step_param)
+            
             ############################################################################################
             # Apply transformations
             with ecol2.expander("Apply trace transformation"):
@@ -249,22 +720,41 @@ if __name__ == "__main__":
                 for param_name, param_type, param_default in params:
                     session_key = TF_PARAM_KEY + param_name
                     if session_key not in st.session_state:
-                        st.session_state[session_key] = param_type()
                         if param_default is not None:
                             st.session_state[session_key] = param_default
+                        else:
+                            st.session_state[session_key] = param_type()
                     
-                    if param_type == bool:
-                        st.checkbox(param_name, key=session_key)
-                    elif param_type == int:
-                        st.number_input(param_name, step=1, key=session_key)
+                    param_input(st, param_name, param_type, session_key)
 
+                st.checkbox("compute in InfluxDB where possible", value=True, key="pushdown",
+                            help="diff, cumsum and resample of raw queried traces are computed by the database")
+                APPLY_TO_OPTIONS = ("selected trace", f"all traces in {sel_trace.unit}", "chosen traces")
+                apply_to = st.radio("apply to", APPLY_TO_OPTIONS, horizontal=True)
+                if apply_to == APPLY_TO_OPTIONS[2]:
+                    st.multiselect("traces", traces_handler.get_traces_names(), key="batch_traces_names")
+                
                 if st.button("apply transformer"):
-                    new_trace = deepcopy(sel_trace)
-                    transformer = transf_interface.get_transformer(st.session_state.transformer_name)
-                    trans_params = {"input_series": new_trace.series}
-                    trans_params.update(get_tf_params_from_session_state())
-                    new_trace.series = transformer(**trans_params)
-                    traces_handler.add_trace(new_trace)
+                    if apply_to == APPLY_TO_OPTIONS[0]:
+                        # derived traces only store the transformer steps, evaluated on demand
+                        traces_handler.add_derived_trace(sel_trace, st.session_state.transformer_name,
+                                                         get_tf_params_from_session_state())
+                    else:
+                        if apply_to == APPLY_TO_OPTIONS[1]:
+                            batch_traces = [trace for trace in st.session_state.traces if trace.unit == sel_trace.unit]
+                        else:
+                            batch_traces = [st.session_state.traces[int(name.split(".")[0])] 
+                                            for name in st.session_state.get("batch_traces_names", list())]
+                        progress = st.progress(0.)
+                        timings = list()
+                        results = traces_handler.apply_transformer_batch(batch_traces, st.session_state.transformer_name,
+                                                                         get_tf_params_from_session_state())
+                        for n, result in enumerate(results, start=1):
+                            progress.progress(n / len(batch_traces), text=f"{n}/{len(batch_traces)} traces transformed")
+                            timings.append({"trace": result.series.name if result.ok() else "", 
+                                            "seconds": round(result.seconds, 3), 
+                                            "error": "" if result.ok() else repr(result.error)})
+                        st.dataframe(pd.DataFrame(timings), hide_index=True)
             
             dcol1, dcol2 = ecol2.columns(2)
             if dcol1.button("delete selected trace", type="primary"):
@@ -278,29 +768,119 @@ if __name__ == "__main__":
         # View traces plots
         st.subheader("View traces plots", divider="blue")
         
-        for fig in traces_handler.get_traces_figures():
-            st.plotly_chart(fig, use_container_width=True)
+        pcol1, pcol2 = st.columns([1, 3])
+        plot_points = pcol1.number_input("plot points per trace", min_value=100, step=500, value=2000,
+                                         help="budget for decimated traces")
+        x_range = None
+        if (time_range := traces_handler.get_time_range()) and time_range[0] < time_range[1]:
+            x_range = pcol2.slider("plot range (UTC)", min_value=time_range[0], max_value=time_range[1], 
+                                   value=time_range, help="zoom into the traces, queried traces are "
+                                   "fetched with a higher resolution for the selected range")
+            if tuple(x_range) == time_range:
+                x_range = None
+        
+        def load_detail(trace: Trace, start: dt.datetime, stop: dt.datetime) -> pd.Series:
+            planner = QueryPlanner(max_points=plot_points)
+            stop = stop + dt.timedelta(seconds=1)
+            if "aggregation" in trace.source:  # same aggregation as the trace, higher resolution only
+                plan = planner.plan_detail(QueryPlan.from_dict(trace.source), start, stop)
+            else:  # source of older versions
+                plan = planner.plan(measurement=trace.source["measurement"], entity_id=trace.source["entity_id"], 
+                                    start=start, stop=stop, aggregation="auto")
+            return interval_store.get_series(interval_store.get_key((host, port, trace.source["database"]), plan),
+                                             plan, lambda gap_plan: load_series(trace.source["database"], gap_plan))
+        
+        with recorder.stage("figure building") as timing:
+            figures = traces_handler.get_traces_figures(plot_points, x_range, load_detail)
+            timing.rows = plotted_points = sum(len(scatter.x) for fig in figures for scatter in fig.data)
+        with recorder.stage("figure serialization") as timing:
+            for fig in figures:
+                st.plotly_chart(fig, use_container_width=True)
+            timing.rows = plotted_points
         
         with st.expander("Upload / download area"):
-            if upload_obj := st.file_uploader(label="upload traces", type="json", accept_multiple_files=False):
-                trace_dict_list = json.load(upload_obj, cls=JsonDec)["content"]
+            if upload_obj := st.file_uploader(label="upload traces", type=["json", "trc"], accept_multiple_files=False):
+                if is_traces_file(upload_obj.getvalue()):
+                    trace_dict_list = loads_traces(upload_obj.getvalue())
+                else:
+                    try:
+                        trace_dict_list = list(iter_json_traces(upload_obj))
+                    except ValueError:  # not written trace by trace, e.g. by older versions
+                        upload_obj.seek(0)
+                        trace_dict_list = json.load(upload_obj, cls=JsonDec)["content"]
+                # new uids, such that uploading a file twice doesn't duplicate them, bases follow
+                uids = {trace_dict["uid"]: uuid.uuid4().hex for trace_dict in trace_dict_list if "uid" in trace_dict}
                 try:
                     for trace_dict in trace_dict_list:
-                        trace = Trace(**trace_dict)
-                        st.session_state.traces.append(trace)
+                        # the source is cleared, the file may come from another server (with the same database names)
+                        trace = Trace(**{**trace_dict, "uid": uids.get(trace_dict.get("uid"), uuid.uuid4().hex),
+                                         "base": uids.get(trace_dict.get("base"), trace_dict.get("base")), 
+                                         "source": None})
+                        traces_handler.add_trace(trace)
                 except Exception as e:
                     st.error(f"Exception {e} while appending {trace=}!")
                 
-            st.download_button("download traces", data=traces_handler.get_traces_as_json(), 
-                            file_name="traces.json")
+            dcol1, dcol2 = st.columns(2)
+            readable = dcol2.checkbox("readable JSON", help="plain value lists instead of base64 packed arrays, large and slow")
+            # the files are built when a button is clicked, not on every run
+            get_traces_binary, get_traces_json = traces_handler.get_traces_exports(readable)
+            dcol1.download_button("download traces", data=get_traces_binary, 
+                                  file_name="traces.trc", help="compact binary format")
+            dcol2.download_button("download traces as JSON", data=get_traces_json, 
+                                  file_name="traces.json")
             
         ############################################################################################
         # Inside streamlit_db_browser
         st.subheader(f"Debug area", divider="blue")
         with st.expander("session state"):
             st.session_state
+        with st.expander("query cache"):
+            st.write(query_cache.get_stats())
+            st.write(interval_store.get_stats())
+            st.write({"calendar resample": get_calendar_resample_stats()})
+            if st.button("clear query cache", help="drop all cached query results, e.g. to see new data"):
+                query_cache.invalidate()
+                st.rerun()
+        with st.expander("trace store"):
+            st.write(get_trace_store().get_stats())
+        with st.expander("entity catalogs"):
+            st.write(get_catalog_store().get_stats())
+            if st.button("reload entity catalogs", help="e.g. to see new entities before the catalogs expire"):
+                get_catalog_store().invalidate()
+                st.rerun()
+        with st.expander("startup"):
+            st.write(get_startup_stats())
+        with st.expander("InfluxDB client pool"):
+            st.write(influx_pool.get_stats())
+        with st.expander("instrumentation"):
+            st.write("stages of the previous run (stages may nest, e.g. queries of details while building figures)")
+            if last_run := st.session_state.get("last_run_stages"):
+                st.dataframe(pd.DataFrame(last_run), hide_index=True)
+            metrics = get_metrics()
+            st.write(f"{metrics.runs} runs of all sessions took {metrics.run_seconds:.1f}s")
+            icol1, icol2 = st.columns(2)
+            icol1.download_button("download metrics as JSON", data=metrics.to_json(), file_name="metrics.json")
+            icol2.download_button("download metrics as Prometheus text", data=metrics.to_prometheus(),
+                                  file_name="metrics.prom")
+            icol1, icol2 = st.columns(2)
+            profiler_name = icol1.selectbox("profiler", ProfileCapture.get_available())
+            if icol2.button("profile a run", help="rerun the app with a profiler, the run is slower then"):
+                st.session_state["profile_run"] = profiler_name
+                st.rerun()
+            if profile_report := st.session_state.get("profile_report"):
+                st.code(profile_report, language=None)
+        with st.expander("figure cache"):
+            st.write(st.session_state["figure_cache"].stats if "figure_cache" in st.session_state else dict())
 
 
     except (Exception, KeyboardInterrupt) as error:
         print(f"{error=}")
-        client.close()
+    
+    finally:  # also on st.rerun()
+        recorder.finish()
+        get_metrics().add_run(recorder)
+        st.session_state["last_run_stages"] = [*recorder.to_records(), 
+                                               {"stage": "total", "seconds": round(recorder.seconds, 4)}]
+        if profiler:
+            st.session_state["profile_report"] = profile_capture.stop()
+            st.rerun()  # to show the report
@@ -0,0 +1,70 @@
+"""The InfluxClientPool of influx_pool must bound the connections and concurrent queries to its
+size and release its clients also when a query fails, checked against the fake InfluxDB
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from fake_influxdb import FakeInfluxDB
+from influx_pool import InfluxClientPool, PoolTimeoutError
+
+INDEX = pd.date_range("2024-01-01", periods=100, freq="1min", tz="UTC")
+DATABASES = {"home": {("kWh", "meter"): pd.Series(np.arange(100.), index=INDEX)}}
+
+
+@pytest.fixture
+def fake():
+    with FakeInfluxDB(DATABASES, delay=0.05) as fake:
+        yield fake
+
+
+@pytest.fixture
+def pool(fake):
+    pool = InfluxClientPool("localhost", fake.port, size=3, acquire_timeout=5.)
+    yield pool
+    pool.close()
+
+
+def script_run(pool: InfluxClientPool) -> int:
+    with pool.client("home") as client:
+        return len(client.get_list_database()) + len(list(client.query("show series").get_points()))
+
+
+def test_pool_bounds_connections_and_concurrency(fake, pool):
+    with ThreadPoolExecutor(8) as executor:
+        assert all(result == 2 for result in executor.map(lambda _: script_run(pool), range(50)))
+    assert fake.get_stats()["connections"] <= 3, "connections should be kept alive and reused"
+    assert fake.get_stats()["max_concurrent_queries"] <= 3, "pool size should bound concurrency"
+    stats = pool.get_stats()
+    assert stats["created"] <= 3 and stats["in_use"] == 0 and stats["acquired"] == 50
+
+
+def test_client_released_on_exception(pool):
+    with pytest.raises(ZeroDivisionError):
+        with pool.client("home") as client:
+            client.query("show series")
+            1 / 0
+    stats = pool.get_stats()
+    assert stats["in_use"] == 0 and stats["discarded"] == 1 and stats["idle"] == 0
+    # e.g. streamlits RerunException, the client is released and kept
+    with pytest.raises(KeyboardInterrupt):
+        with pool.client("home"):
+            raise KeyboardInterrupt
+    stats = pool.get_stats()
+    assert stats["in_use"] == 0 and stats["idle"] == 1
+    # all slots are free again
+    clients = [pool.acquire() for _ in range(pool.size)]
+    for client in clients:
+        pool.release(client)
+    assert script_run(pool) == 2
+
+
+def test_acquire_times_out_when_exhausted(fake):
+    pool = InfluxClientPool("localhost", fake.port, size=1, acquire_timeout=0.1)
+    with pool.client():
+        with pytest.raises(PoolTimeoutError):
+            pool.acquire()
+    assert pool.get_stats()["timeouts"] == 1
+    assert script_run(pool) == 2
+    pool.close()
@@ -0,0 +1,77 @@
+"""The pushed down queries of query_pushdown must return exactly what the pandas transformers
+return for the raw data, checked against the fake InfluxDB
+"""
+
+import datetime as dt
+import numpy as np
+import pandas as pd
+import pytest
+from influxdb import InfluxDBClient
+from fake_influxdb import FakeInfluxDB
+from influx_loader import query_series
+from pipeline import make_step
+from query_planner import QueryPlan
+from query_pushdown import translate
+from SignalTransformer import SignalTransformersInterface
+
+PLAN = QueryPlan("kWh", "meter", dt.datetime(2024, 1, 1), dt.datetime(2024, 6, 1))
+STEPS = [make_step("diff", {}), make_step("cumsum", {})] + [
+    make_step("resample", {"interval_hours": hours, "aggregate_sum": aggregate_sum, "fill_na": fill_na})
+    for hours in (1, 6, 24, 48) for aggregate_sum, fill_na in ((False, False), (False, True), (True, False))]
+
+
+@pytest.fixture(scope="module")
+def meter() -> pd.Series:
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2024-01-01 00:17", periods=50_000, freq="7min", tz="UTC")
+    index = index.delete(rng.choice(len(index), 20_000, replace=False))  # irregular, with empty days
+    index = index[(index < "2024-02-10") | (index > "2024-02-20")]
+    return pd.Series(rng.normal(size=len(index)).cumsum(), index=index)
+
+
+@pytest.fixture(scope="module")
+def client(meter):
+    with FakeInfluxDB({"home": {("kWh", "meter"): meter}}) as fake:
+        client = InfluxDBClient(port=fake.port, database="home")
+        yield client
+        client.close()
+
+
+def check_pushdown(client: InfluxDBClient, step: dict, input_series: pd.Series, last: pd.Timestamp = None):
+    interface = SignalTransformersInterface()
+    expected = interface.get_transformer(step["transformer"])(input_series=input_series, **step["params"])
+    pushdown = translate(PLAN, step, last)
+    if pushdown is None:
+        assert step["transformer"] == "resample" and 24 % step["params"]["interval_hours"]
+        return
+    result = pushdown.postprocess(query_series(client, pushdown.get_query_string()), input_series, interface)
+    pd.testing.assert_series_equal(result, expected, check_freq=False, check_index_type=False)
+    assert pushdown.matches(result, input_series, interface)
+
+
+@pytest.mark.parametrize("step", STEPS, ids=lambda step: f"{step['transformer']}{step['params']}")
+def test_pushdown_equals_pandas(client, step):
+    input_series = query_series(client, PLAN.get_query_string(), name="meter")
+    check_pushdown(client, step, input_series)
+
+
+@pytest.mark.parametrize("step", STEPS, ids=lambda step: f"{step['transformer']}{step['params']}")
+def test_pushdown_leaves_out_newer_points(client, meter, step):
+    # the source series was loaded before the points after April were written
+    input_series = meter[meter.index < "2024-04-01 03:10"].rename("meter").rename_axis("time")
+    check_pushdown(client, step, input_series, last=input_series.index[-1])
+
+
+@pytest.mark.parametrize("step", STEPS, ids=lambda step: f"{step['transformer']}{step['params']}")
+def test_pushdown_detects_other_database_content(client, step):
+    # e.g. a trace of another server with the same database name, or points changed by retention
+    interface = SignalTransformersInterface()
+    input_series = query_series(client, PLAN.get_query_string(), name="meter") * 2 + 1
+    if (pushdown := translate(PLAN, step, input_series.index[-1])) is None:
+        return
+    result = pushdown.postprocess(query_series(client, pushdown.get_query_string()), input_series, interface)
+    assert not pushdown.matches(result, input_series, interface)
+    # dropped points change the index or the buckets
+    dropped = input_series.iloc[len(input_series) // 2:] / 2 - .5
+    assert not pushdown.matches(pushdown.postprocess(query_series(client, pushdown.get_query_string()), 
+                                                     dropped, interface), dropped, interface)
@@ -0,0 +1,155 @@
+"""Module providing a compact binary traces file format
+
+Layout (little endian):
+    magic          8 bytes   b"STDBTRC\\0"
+    version        uint32
+    header length  uint32
+    header         UTF-8 JSON, padded to a multiple of 8 bytes
+    buffers        raw arrays, each starting at a multiple of 8 bytes after the header
+
+The header holds the trace metadata (all dataclass fields except the series) and for each
+trace the offset, length and dtype of its index (int64 epoch nanoseconds) and data arrays.
+Loading wraps the arrays around the given buffer without copying, files are memory-mapped.
+"""
+
+import json
+import mmap
+import struct
+import numpy as np
+import pandas as pd
+from dataclasses import fields
+
+MAGIC = b"STDBTRC\0"
+VERSION = 1
+PREAMBLE = struct.Struct("<8sII")
+FILE_TYPE = "Streamlit database browser traces file"
+ALIGNMENT = 8
+
+
+def _pad(nbytes: int) -> int:
+    return -nbytes % ALIGNMENT
+
+
+def dumps_traces(traces: list) -> bytes:
+    """Returns the binary traces file content of the traces (dataclasses with a series field)
+    """
+    header = {"type": FILE_TYPE, "version": VERSION, "traces": list()}
+    buffers = list()
+    offset = 0
+
+    def add_buffer(array: np.ndarray) -> dict:
+        nonlocal offset
+        array = np.ascontiguousarray(array)
+        info = {"offset": offset, "length": len(array), "dtype": array.dtype.str}
+        buffers.append(array)
+        offset += array.nbytes + _pad(array.nbytes)
+        return info
+
+    for trace in traces:
+        meta = {f.name: getattr(trace, f.name) for f in fields(trace) if f.name != "series"}
+        series = trace.series
+        index = pd.DatetimeIndex(series.index)
+        meta["series"] = {"name": series.name,
+                          "tz": None if index.tz is None else str(index.tz),
+                          "index": add_buffer(index.as_unit("ns").asi8)}
+        values = series.to_numpy()
+        if values.dtype.kind in "biuf":
+            meta["series"]["data"] = add_buffer(values)
+        else:  # e.g. strings, not worth a buffer
+            meta["series"]["values"] = values.tolist()
+        header["traces"].append(meta)
+
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b" " * _pad(len(header_bytes))
+    chunks = [PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)), header_bytes]
+    for array in buffers:
+        chunks.append(array.tobytes())
+        chunks.append(b"\0" * _pad(array.nbytes))
+    return b"".join(chunks)
+
+
+def loads_traces(buffer) -> list:
+    """Returns a list of trace dicts (with series) from a binary traces file content.
+
+    The series arrays share memory with buffer (bytes, memoryview, mmap, ...), so they are read-only.
+    """
+    magic, version, header_length = PREAMBLE.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a binary traces file")
+    if version > VERSION:
+        raise ValueError(f"Unsupported binary traces file version {version}, max. {VERSION}")
+    header_start = PREAMBLE.size
+    header = json.loads(bytes(buffer[header_start:header_start + header_length]))
+    data_start = header_start + header_length
+
+    def get_array(info: dict) -> np.ndarray:
+        return np.frombuffer(buffer, dtype=np.dtype(info["dtype"]), count=info["length"],
+                             offset=data_start + info["offset"])
+
+    traces = list()
+    for meta in header["traces"]:
+        series_info = meta.pop("series")
+        index = pd.DatetimeIndex(get_array(series_info["index"]).view("datetime64[ns]"))
+        if series_info["tz"] is not None:
+            index = index.tz_localize("UTC").tz_convert(series_info["tz"])
+        index.name = "time"
+        if "data" in series_info:
+            values = get_array(series_info["data"])
+        else:
+            values = series_info["values"]
+        meta["series"] = pd.Series(values, index=index, name=series_info["name"], copy=False)
+        traces.append(meta)
+    return traces
+
+
+def is_traces_file(buffer) -> bool:
+    return bytes(buffer[:len(MAGIC)]) == MAGIC
+
+
+def load_traces(path: str) -> list:
+    """Returns a list of trace dicts from a binary traces file, memory-mapped
+    """
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return loads_traces(buffer)
+
+
+def save_traces(path: str, traces: list) -> None:
+    with open(path, "wb") as file:
+        file.write(dumps_traces(traces))
+
+
+if __name__ == "__main__":
+    import time
+    from dataclasses import dataclass, field
+    from json_encoder_decoder import JsonEnc, JsonDec
+
+    @dataclass
+    class Trace:
+        entity: str
+        unit: str
+        line_mode: str = "lines"
+        series: pd.Series = field(default_factory=pd.Series, compare=False, hash=False, repr=False)
+
+    for n in (10_000, 100_000, 1_000_000):
+        index = pd.date_range("2024-01-01", periods=n, freq="10s", tz="UTC", name="time")
+        traces = [Trace("meter", "kWh", series=pd.Series(np.random.default_rng(0).normal(size=n),
+                                                         index=index, name="meter"))]
+
+        t0 = time.perf_counter()
+        binary = dumps_traces(traces)
+        t1 = time.perf_counter()
+        loaded = loads_traces(binary)
+        t2 = time.perf_counter()
+        assert loaded[0]["series"].equals(traces[0].series)
+
+        content = [{"entity": trace.entity, "unit": trace.unit, "line_mode": trace.line_mode,
+                    "series": trace.series} for trace in traces]
+        t3 = time.perf_counter()
+        json_str = json.dumps({"content": content}, cls=JsonEnc)
+        t4 = time.perf_counter()
+        json.loads(json_str, cls=JsonDec)
+        t5 = time.perf_counter()
+
+        print(f"{n=:>9,}: binary {len(binary) / 2**20:6.1f} MB, dump {t1 - t0:.3f}s, load {t2 - t1:.4f}s | "
+              f"JSON {len(json_str) / 2**20:6.1f} MB, dump {t4 - t3:.3f}s, load {t5 - t4:.3f}s")
@@ -0,0 +1,312 @@
+"""Module providing a compact store of trace series, shared by all sessions, with memory budgets
+
+Each series is stored once per content, so identical series added by several sessions (e.g. the
+same query) are shared. Only float64 series with a DatetimeIndex are stored (see can_store), the
+index as int64 epoch time (in its unit). When the resident bytes exceed the global budget or the
+budget of a session, the least recently used series are spilled to memory-mapped files in
+spill_dir, the values as float32 if they can be restored exactly (see compact_values). Resident
+series always hold float64 values, so their series are views without a second copy.
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import weakref
+import numpy as np
+import pandas as pd
+from pandas.arrays import DatetimeArray
+
+
+def compact_values(values: np.ndarray) -> tuple:
+    """Returns (float32 values, decimals) if rounding the float32 values to decimals restores
+    values exactly (decimals is None if no rounding is needed), else (float64 values, None)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values32 = values.astype(np.float32)
+    restored = values32.astype(np.float64)
+    if np.array_equal(restored, values, equal_nan=True):
+        return values32, None
+    sample = values[:1000]
+    for decimals in range(1, 7):
+        if np.array_equal(np.round(sample, decimals), sample, equal_nan=True):
+            break  # the sample has at most decimals, verify all values below
+    if np.array_equal(np.round(restored, decimals), values, equal_nan=True):
+        return values32, decimals
+    return values, None
+
+
+def restore_values(values: np.ndarray, decimals: int = None) -> np.ndarray:
+    if values.dtype == np.float64:
+        return values
+    values = np.array(values, dtype=np.float64)  # an ndarray, also for a memmap
+    return values if decimals is None else np.round(values, decimals, out=values)
+
+
+def get_index(times: np.ndarray, unit: str = "ns", tz: str = None, name: str = None) -> pd.DatetimeIndex:
+    """Returns a DatetimeIndex sharing memory with the int64 epoch times in unit (e.g. a
+    memmap). The public constructors copy tz-aware data.
+    """
+    values = times.view(f"datetime64[{unit}]")
+    dtype = values.dtype if tz is None else pd.DatetimeTZDtype(unit, tz)
+    return pd.DatetimeIndex(DatetimeArray._simple_new(values, dtype=dtype), name=name, copy=False)
+
+
+def _resident_bytes(array: np.ndarray) -> int:
+    return 0 if array is None or isinstance(array, np.memmap) else array.nbytes
+
+
+class StoredSeries():
+    """A series in the store, compact and unnamed (the trace holds the name)
+    """
+    __slots__ = ("key", "times", "values", "decimals", "compact", "unit", "tz", "index_name", "sessions",
+                 "last_used", "path", "_series", "__weakref__")
+
+    def __init__(self, key: str, times: np.ndarray, values: np.ndarray, unit: str, tz: str, index_name: str) -> None:
+        self.key = key
+        self.times = times
+        self.values = values  # float64, or the float32 values of the spill file (see decimals)
+        self.decimals = None
+        self.compact = False  # float32 values in the spill file
+        self.unit = unit
+        self.tz = tz
+        self.index_name = index_name
+        self.sessions = set()
+        self.last_used = time.monotonic()
+        self.path = None  # of the spill files, once spilled
+        self._series = None  # materialized, a view of times and values
+
+    def get_series(self) -> pd.Series:
+        """Returns the series, the same (values) object as long as it's not spilled, such that
+        its fingerprint (see pipeline.py) and everything cached by it stays valid. Spilled
+        float32 values are restored to resident float64 values.
+        """
+        if self._series is None:
+            if self.values.dtype != np.float64:
+                self.values = restore_values(self.values, self.decimals)
+            index = get_index(self.times, self.unit, self.tz, self.index_name)
+            self._series = pd.Series(self.values, index=index, copy=False)
+        return self._series
+
+    def get_resident_bytes(self) -> int:
+        return _resident_bytes(self.times) + _resident_bytes(self.values)
+
+    def is_spilled(self) -> bool:
+        return isinstance(self.times, np.memmap)
+
+    def spill(self, spill_dir: str) -> None:
+        """Moves the arrays to memory-mapped files (written once, series are immutable)
+        """
+        if self.path is None:
+            self.path = os.path.join(spill_dir, self.key)
+            values, self.decimals = compact_values(self.values)
+            self.compact = values.dtype == np.float32
+            np.save(self.path + ".times.npy", self.times)
+            np.save(self.path + ".values.npy", values)
+        self.times = np.load(self.path + ".times.npy", mmap_mode="r")
+        self.values = np.load(self.path + ".values.npy", mmap_mode="r")
+        self._series = None
+
+    def delete_files(self) -> None:
+        if self.path is not None:
+            self.times = self.values = self._series = None  # close the memmaps before removing the files
+            for suffix in (".times.npy", ".values.npy"):
+                try:
+                    os.remove(self.path + suffix)
+                except OSError:
+                    pass
+
+
+class TraceStore():
+    """Thread-safe store of series referenced by sessions, limited by budget_bytes in total
+    and session_budget_bytes per session (shared series count for each session using them)
+    """
+    def __init__(self, budget_bytes: int = 512 * 2**20, session_budget_bytes: int = 256 * 2**20,
+                 spill_dir: str = None) -> None:
+        self.budget_bytes = budget_bytes
+        self.session_budget_bytes = session_budget_bytes
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix="trace_store_")
+        self._records = dict()  # key: StoredSeries
+        self._sessions = dict()  # session id: set of keys
+        self._lock = threading.RLock()
+        self._stats = {"shared": 0, "spills": 0}
+
+    def open_session(self) -> "TraceStoreSession":
+        """Returns a session handle, its references are released when it's garbage collected
+        (e.g. with the streamlit session state)
+        """
+        session = TraceStoreSession(self)
+        with self._lock:
+            self._sessions[session.id] = set()
+        return session
+
+    @staticmethod
+    def can_store(series: pd.Series) -> bool:
+        """Returns True for float64 series with a DatetimeIndex, others (e.g. strings, int or
+        bool) would change their dtype
+        """
+        return series.dtype == np.float64 and isinstance(series.index, pd.DatetimeIndex)
+
+    def put(self, session_id: str, series: pd.Series) -> str:
+        """Stores series (see can_store) for the session and returns its key
+        """
+        if not self.can_store(series):
+            raise TypeError(f"Only float64 series with a DatetimeIndex can be stored, not {series.dtype}")
+        index = series.index
+        times = np.ascontiguousarray(index.asi8)
+        values = np.ascontiguousarray(series.to_numpy())
+        tz = None if index.tz is None else str(index.tz)
+        digest = hashlib.blake2b(memoryview(times).cast("B"), digest_size=16)
+        digest.update(memoryview(values).cast("B"))
+        digest.update(f"{index.unit}{tz}{index.name}".encode())
+        key = digest.hexdigest()
+        with self._lock:
+            if key in self._records:
+                self._stats["shared"] += 1
+            else:
+                # views (e.g. an iloc slice of a larger buffer) are copied, they would pin their base
+                times, values = (array if array.base is None and array.flags.owndata else array.copy() 
+                                 for array in (times, values))
+                self._records[key] = StoredSeries(key, times, values, index.unit, tz, index.name)
+            self._records[key].sessions.add(session_id)
+            self._sessions.setdefault(session_id, set()).add(key)
+            self._enforce_budgets()
+        return key
+
+    def get(self, key: str) -> pd.Series:
+        """Returns the (unnamed) series of key, don't modify it
+        """
+        with self._lock:
+            record = self._records[key]
+            record.last_used = time.monotonic()
+            was_resident = record.get_resident_bytes()
+            series = record.get_series()
+            if record.get_resident_bytes() > was_resident:
+                self._enforce_budgets(keep=record)
+            return series
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._records
+
+    def set_session_keys(self, session_id: str, keys: set) -> None:
+        """Sets the keys referenced by the session, series not referenced anymore are removed
+        """
+        with self._lock:
+            old_keys = self._sessions.get(session_id, set())
+            self._sessions[session_id] = set(keys) & set(self._records)
+            for key in old_keys - self._sessions[session_id]:
+                self._release(session_id, key)
+
+    def release_session(self, session_id: str) -> None:
+        with self._lock:
+            for key in self._sessions.pop(session_id, set()):
+                self._release(session_id, key)
+
+    def _release(self, session_id: str, key: str) -> None:
+        record = self._records.get(key)
+        if record is not None:
+            record.sessions.discard(session_id)
+            if not record.sessions:
+                del self._records[key]
+                record.delete_files()
+
+    def _get_session_bytes(self, session_id: str) -> int:
+        return sum(self._records[key].get_resident_bytes() for key in self._sessions.get(session_id, ()))
+
+    def _enforce_budgets(self, keep: StoredSeries = None) -> None:
+        """Spills the least recently used resident series (except keep) while over budget
+        """
+        candidates = sorted((record for record in self._records.values()
+                             if record is not keep and record.get_resident_bytes()), key=lambda r: r.last_used)
+        resident = sum(record.get_resident_bytes() for record in self._records.values())
+        for record in candidates:
+            if resident <= self.budget_bytes:
+                break
+            resident -= self._spill(record)
+        for session_id, keys in self._sessions.items():
+            session_bytes = self._get_session_bytes(session_id)
+            for record in candidates:
+                if session_bytes <= self.session_budget_bytes:
+                    break
+                if record.key in keys and record.get_resident_bytes():
+                    session_bytes -= self._spill(record)
+
+    def _spill(self, record: StoredSeries) -> int:
+        """Spills record and returns the number of resident bytes freed
+        """
+        nbytes = record.get_resident_bytes()
+        record.spill(self.spill_dir)
+        self._stats["spills"] += 1
+        return nbytes - record.get_resident_bytes()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            records = list(self._records.values())
+            return {"series": len(records),
+                    "spilled": sum(record.is_spilled() for record in records),
+                    "resident_MB": round(sum(record.get_resident_bytes() for record in records) / 2**20, 1),
+                    "spilled_float32": sum(record.compact for record in records),
+                    "sessions_MB": {session_id[:8]: round(self._get_session_bytes(session_id) / 2**20, 1)
+                                    for session_id in self._sessions},
+                    **self._stats}
+
+    def close(self) -> None:
+        with self._lock:
+            for record in self._records.values():
+                record.delete_files()
+            self._records.clear()
+            self._sessions.clear()
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+
+class TraceStoreSession():
+    """Handle of a session of a TraceStore, releasing the sessions series when collected
+    """
+    def __init__(self, store: TraceStore) -> None:
+        self.id = os.urandom(16).hex()
+        self.store = store
+        weakref.finalize(self, store.release_session, self.id)
+
+    def put(self, series: pd.Series) -> str:
+        return self.store.put(self.id, series)
+
+    def get(self, key: str) -> pd.Series:
+        return self.store.get(key)
+
+    def set_keys(self, keys: set) -> None:
+        self.store.set_session_keys(self.id, keys)
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2023-01-01", "2024-01-01", freq="1min", tz="UTC", name="time")
+    temperature = pd.Series(np.round(rng.normal(20, 3, len(index)), 1), index=index)  # 0.1 °C resolution
+    energy = pd.Series(rng.random(len(index)).cumsum() * 1000, index=index)  # not compactable
+    assert not TraceStore.can_store(pd.Series(["on", "off"], index=index[:2]))
+
+    store = TraceStore(budget_bytes=16 * 2**20, session_budget_bytes=12 * 2**20)
+    sessions = [store.open_session() for _ in range(3)]
+    keys = [(session.put(temperature), session.put(energy)) for session in sessions]
+    assert len({key for pair in keys for key in pair}) == 2  # shared by the sessions
+    for series, key in zip((temperature, energy), keys[0]):
+        restored = store.get(key)
+        pd.testing.assert_series_equal(restored, series, check_names=False, check_freq=False)
+    print(f"2 series of {len(index):,} points ({(temperature.nbytes + energy.nbytes) * 2 / 2**20:.0f}MB with index) "
+          f"in 3 sessions: {store.get_stats()}")
+
+    # the temperature values were spilled as float32, get restored them to resident float64 values
+    assert store.get(keys[0][0]).values.dtype == np.float64 and not isinstance(store.get(keys[0][0]).values, np.memmap)
+    assert store.get(keys[0][0]) is store.get(keys[0][0])  # the same object while resident
+
+    # a slice of a larger series is stored as a copy, not as a view pinning the whole buffer
+    session = store.open_session()
+    sliced = energy * 1
+    key = session.put(sliced.iloc[10:20])
+    assert not np.shares_memory(store.get(key).values, sliced.values)
+    assert not np.shares_memory(store.get(key).index.asi8, sliced.index.asi8)
+
+    del sessions, session, restored
+    print(f"sessions collected: {store.get_stats()}")
+    store.close()